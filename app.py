@@ -1,10 +1,40 @@
 import os
+import io
+import atexit
+import base64
+import hashlib
+import re
+import shutil
+import csv
 import datetime
+import itertools
 import json
-from flask import Flask, render_template_string, request, redirect, url_for, flash, jsonify, abort
+import math
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import Counter, OrderedDict
+import click
+import functools
+import weakref
+try:
+    import fcntl  # POSIX only; dead-worker compaction is skipped without it
+except ImportError:
+    fcntl = None
+from flask import Flask, Response, current_app, g, has_app_context, has_request_context, render_template, request, redirect, url_for, flash, jsonify, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from jinja2 import DictLoader
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import make_transient_to_detached
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
 
 # --- 1. INITIALIZE EXTENSIONS (WITHOUT APP INSTANCE) ---
 db = SQLAlchemy()
@@ -22,6 +52,8 @@ class User(UserMixin, db.Model):
     transactions = db.relationship('Transaction', backref='owner', lazy=True, cascade="all, delete-orphan")
     debts = db.relationship('Debt', backref='owner', lazy=True, cascade="all, delete-orphan")
     categories = db.relationship('Category', backref='owner', lazy=True, cascade="all, delete-orphan")
+    monthly_summaries = db.relationship('MonthlySummary', backref='owner', lazy=True, cascade="all, delete-orphan")
+    data_version = db.relationship('DataVersion', lazy=True, uselist=False, cascade="all, delete-orphan")
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -31,7 +63,13 @@ class Transaction(db.Model):
     category = db.Column(db.String(50), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     debt_paid = db.Column(db.String(100), nullable=True)
+    debt_id = db.Column(db.Integer, db.ForeignKey('debt.id', ondelete='SET NULL'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_transaction_user_date', 'user_id', 'date'),
+        db.Index('ix_transaction_user_type_date', 'user_id', 'type', 'date'),
+        db.Index('ix_transaction_user_debt_date', 'user_id', 'debt_id', 'date'),
+    )
 
 class Debt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,30 +81,780 @@ class Debt(db.Model):
     min_payment = db.Column(db.Float, nullable=False)
     due_day = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    __table_args__ = (db.Index('ix_debt_user_name', 'user_id', 'name'),)
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     type = db.Column(db.String(10), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    __table_args__ = (db.Index('ix_category_user_type', 'user_id', 'type'),)
+
+class MonthlySummary(db.Model):
+    # Per-user/month/type/category rollup, kept in sync with Transaction inside the same commit
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(10), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    tx_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('user_id', 'year', 'month', 'type', 'category', name='uq_monthly_summary_bucket'),)
+
+class DataVersion(db.Model):
+    # Bumped by every write path; API ETags (and caches) key off it
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+DEBT_PAYMENT_CATEGORY = 'ชำระหนี้'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # The username is cached; merge(load=False) re-attaches it to this request's session without a query
+    cache, key = current_app.extensions['reference_cache'], f"user:{int(user_id)}"
+    cached = cache.get(key)
+    if cached is None:
+        user = db.session.get(User, int(user_id))
+        if user is not None: cache.set(key, {'id': user.id, 'username': user.username})
+        return user
+    user = User(**cached)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
     
+def monthly_rate_of(debt):
+    return (debt.rate_percent / 100) / 12 if debt.rate_type == 'yearly' else debt.rate_percent / 100
+
+def add_months(date, months):
+    month_index = date.month - 1 + months
+    year, month = date.year + month_index // 12, month_index % 12 + 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return date.replace(year=year, month=month, day=min(date.day, (next_month - datetime.timedelta(days=1)).day))
+
 def calculate_debt_payoff_logic(debt, extra_payment=0):
     balance = debt.current_balance
     if not balance > 0: return "หนี้ชำระหมดแล้ว", "N/A"
-    monthly_rate = (debt.rate_percent / 100) / 12 if debt.rate_type == 'yearly' else debt.rate_percent / 100
+    monthly_rate = monthly_rate_of(debt)
     total_payment = debt.min_payment + extra_payment
     if total_payment <= 0: return "ยอดชำระต้องมากกว่า 0", None
     if total_payment <= balance * monthly_rate and total_payment > 0: return "ไม่มีวันหมด (ยอดชำระน้อยกว่าดอกเบี้ย)", None
+    import numpy as np  # deferred: NumPy is only needed by the debt calculators, keep it off the boot path
     try:
-        months = -np.log(1 - (balance * monthly_rate) / total_payment) / np.log(1 + monthly_rate)
-        payoff_date = datetime.date.today() + datetime.timedelta(days=months * 30.44)
+        months = -np.log(1 - (balance * monthly_rate) / total_payment) / np.log(1 + monthly_rate) if monthly_rate > 0 else balance / total_payment
+        payoff_date = add_months(datetime.date.today(), int(np.ceil(months)))
         return f"{months:.1f} เดือน", payoff_date.strftime('%d-%m-%Y')
     except (ValueError, ZeroDivisionError): return "คำนวณไม่ได้", None
 
+PAYOFF_STRATEGIES = ('avalanche', 'snowball')
+MAX_PAYOFF_MONTHS = 600
+
+@functools.lru_cache(maxsize=256)
+def _simulate_payoff_cached(balances, rates, min_payments, strategy, extra_payment, max_months):
+    import numpy as np
+    balance = np.array(balances, dtype=float)
+    rate = np.array(rates, dtype=float)
+    minimum = np.array(min_payments, dtype=float)
+    # avalanche = highest rate first, snowball = smallest balance first; ties keep input order
+    order = np.lexsort((np.arange(len(balance)), -rate)) if strategy == 'avalanche' else np.lexsort((np.arange(len(balance)), balance))
+    budget = minimum.sum() + extra_payment  # fixed budget, so a paid-off debt's minimum rolls into the next target
+    rows = {'balance': [], 'interest': [], 'principal': [], 'payment': []}
+    for _ in range(max_months):
+        if not (balance > 1e-9).any(): break
+        interest = balance * rate
+        owed = balance + interest
+        payment = np.minimum(minimum, owed)
+        leftover = budget - payment.sum()
+        if leftover > 0:
+            remaining = (owed - payment)[order]
+            already_taken = np.cumsum(remaining) - remaining
+            payment[order] += np.clip(leftover - already_taken, 0, remaining)
+        balance = np.where(owed - payment > 1e-9, owed - payment, 0.0)
+        rows['balance'].append(balance); rows['interest'].append(interest); rows['principal'].append(payment - interest); rows['payment'].append(payment)
+    schedule = {key: np.array(value).reshape(len(value), len(balances)) for key, value in rows.items()}
+    for value in schedule.values(): value.setflags(write=False)
+    return schedule
+
+def simulate_debt_payoff(debts, strategy='avalanche', extra_payment=0.0, max_months=MAX_PAYOFF_MONTHS):
+    """Simulate all debts together month by month.
+
+    Returns arrays shaped (months, len(debts)) under 'balance', 'interest',
+    'principal' and 'payment'. Results are memoised on the debts' numbers so
+    repeated slider requests with the same inputs skip the simulation.
+    """
+    if strategy not in PAYOFF_STRATEGIES: raise ValueError(f"unknown strategy: {strategy}")
+    if not math.isfinite(extra_payment) or extra_payment < 0: raise ValueError("extra_payment must be a finite amount >= 0")
+    debts = list(debts)
+    return _simulate_payoff_cached(
+        tuple(max(d.current_balance, 0.0) for d in debts), tuple(monthly_rate_of(d) for d in debts),
+        tuple(d.min_payment for d in debts), strategy, float(extra_payment), max_months)
+
+def apply_to_monthly_summary(user_id, date, tx_type, category, amount, count=1):
+    # Call before commit so the rollup changes in the same DB transaction (negative amount/count on delete).
+    # The increment happens in SQL (upsert), so concurrent workers never overwrite each other's totals
+    bucket = {'user_id': user_id, 'year': date.year, 'month': date.month, 'type': tx_type, 'category': category}
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(db.session.get_bind().dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(MonthlySummary).values(**bucket, total=amount, tx_count=count)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=list(bucket), set_={'total': MonthlySummary.total + stmt.excluded.total, 'tx_count': MonthlySummary.tx_count + stmt.excluded.tx_count}))
+        return
+    updated = db.session.execute(db.update(MonthlySummary).filter_by(**bucket).values(total=MonthlySummary.total + amount, tx_count=MonthlySummary.tx_count + count)).rowcount
+    if not updated: db.session.execute(db.insert(MonthlySummary).values(**bucket, total=amount, tx_count=count))
+
+def bump_data_version(user_id):
+    # Call before commit alongside the write it describes
+    updated = db.session.execute(db.update(DataVersion).where(DataVersion.user_id == user_id).values(version=DataVersion.version + 1)).rowcount
+    if not updated: db.session.add(DataVersion(user_id=user_id, version=1))
+    db.session.info.setdefault('bumped_user_ids', set()).add(user_id)
+    if has_request_context(): g.get('data_versions', {}).pop(user_id, None)
+
+def bump_data_versions(user_ids=None):
+    # Set-based bump for maintenance writes (rebuilds, backfills); None means every user
+    scope = User.id.in_(user_ids) if user_ids is not None else db.true()
+    ids = set(db.session.scalars(db.select(User.id).where(scope)))
+    if not ids: return
+    db.session.execute(db.update(DataVersion).where(DataVersion.user_id.in_(db.select(User.id).where(scope))).values(version=DataVersion.version + 1))
+    missing = db.select(User.id, db.literal(1)).where(scope, ~db.exists().where(DataVersion.user_id == User.id))
+    db.session.execute(db.insert(DataVersion).from_select(['user_id', 'version'], missing))
+    db.session.info.setdefault('bumped_user_ids', set()).update(ids)
+    if has_request_context(): g.pop('data_versions', None)
+
+def get_data_version(user_id):
+    return db.session.execute(db.select(DataVersion.version).where(DataVersion.user_id == user_id)).scalar() or 0
+
+def current_data_version(user_id):
+    # Memoised per request. Local caches always ask the DB (other workers may have written);
+    # shared caches hold it until the bumping commit deletes it
+    memo = g.setdefault('data_versions', {}) if has_request_context() else {}
+    if user_id not in memo:
+        cache = current_app.extensions['reference_cache']
+        version = cache.get(f"dv:{user_id}") if cache.shared else None
+        if version is None:
+            version = get_data_version(user_id)
+            if cache.shared: cache.set(f"dv:{user_id}", version, ttl=current_app.config['CACHE_VERSION_TTL'])
+        memo[user_id] = version
+    return memo[user_id]
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_committed_versions(session):
+    bumped = session.info.pop('bumped_user_ids', None)
+    if not bumped or not has_app_context(): return
+    cache = current_app.extensions.get('reference_cache')
+    if cache is not None and cache.shared:
+        for user_id in bumped: cache.delete(f"dv:{user_id}")
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_versions(session):
+    session.info.pop('bumped_user_ids', None)
+
+# Indexes earlier releases created that no query uses any more
+RETIRED_INDEXES = ('ix_transaction_user_category_debt',)
+
+def has_debt_id_column(inspector=None):
+    return 'debt_id' in {c['name'] for c in (inspector or db.inspect(db.engine)).get_columns('transaction')}
+
+def rollup_needs_backfill():
+    # every transaction write also writes its rollup row, so an empty rollup over existing rows was never backfilled
+    has_rows = lambda model: db.session.execute(db.select(db.exists().select_from(model))).scalar()
+    return has_rows(Transaction) and not has_rows(MonthlySummary)
+
+def schema_is_current():
+    # False for a database that predates the current models and still needs migrate-db
+    return has_debt_id_column() and not rollup_needs_backfill()
+
+def migrate_schema():
+    """Bring an existing database up to the current models (idempotent).
+
+    create_all() only adds missing tables, so new columns and indexes on
+    existing tables are added here. When Transaction.debt_id is first added
+    it is backfilled from the legacy free-text debt_paid name, and a new
+    monthly rollup is filled from the raw transactions. Run once per deploy
+    via `flask --app app migrate-db`, not from every worker's boot.
+    """
+    db.create_all()
+    engine = db.engine
+    inspector = db.inspect(engine)
+    affected, backfilled = [], 0
+    with engine.begin() as conn:
+        added_debt_id = not has_debt_id_column(inspector)
+        if added_debt_id:
+            conn.execute(db.text('ALTER TABLE "transaction" ADD COLUMN debt_id INTEGER REFERENCES debt(id) ON DELETE SET NULL'))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes: index.create(conn, checkfirst=True)
+        for name in RETIRED_INDEXES: conn.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+        if added_debt_id:
+            matching_debt = db.select(db.func.min(Debt.id)).where(Debt.user_id == Transaction.user_id, Debt.name == Transaction.debt_paid).scalar_subquery()
+            unlinked = (Transaction.debt_id.is_(None), Transaction.category == DEBT_PAYMENT_CATEGORY, db.exists().where(Debt.user_id == Transaction.user_id, Debt.name == Transaction.debt_paid))
+            affected = list(conn.scalars(db.select(Transaction.user_id).where(*unlinked).distinct()))
+            backfilled = conn.execute(db.update(Transaction).where(*unlinked).values(debt_id=matching_debt)).rowcount
+    if affected:
+        # debt history responses changed under cached ETags
+        bump_data_versions(affected)
+        db.session.commit()
+    if rollup_needs_backfill(): rebuild_monthly_summaries()
+    return backfilled
+
+def rebuild_monthly_summaries(user_id=None):
+    # Recompute rollup rows from raw transactions (backfill, or repair drifted totals)
+    stale = MonthlySummary.query
+    if user_id is not None: stale = stale.filter_by(user_id=user_id)
+    stale.delete(synchronize_session=False)
+    year_col, month_col = db.extract('year', Transaction.date), db.extract('month', Transaction.date)
+    grouped = db.session.query(Transaction.user_id, year_col, month_col, Transaction.type, Transaction.category, db.func.sum(Transaction.amount), db.func.count(Transaction.id))
+    if user_id is not None: grouped = grouped.filter(Transaction.user_id == user_id)
+    grouped = grouped.group_by(Transaction.user_id, year_col, month_col, Transaction.type, Transaction.category)
+    rows = [{'user_id': uid, 'year': int(y), 'month': int(m), 'type': t, 'category': c, 'total': float(total or 0), 'tx_count': n} for uid, y, m, t, c, total, n in grouped]
+    if rows: db.session.execute(db.insert(MonthlySummary), rows)
+    bump_data_versions(None if user_id is None else [user_id])
+    db.session.commit()
+    return len(rows)
+
+
+# --- BULK IMPORT PIPELINE (CSV/OFX -> validate -> chunked insert) ---
+IMPORT_DEFAULT_CATEGORY = 'อื่นๆ'
+IMPORT_CHUNK_SIZE = 1000
+DEBT_HISTORY_PAGE_SIZE = 20
+_OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+
+def iter_csv_rows(text_stream):
+    # fields beyond the header land under the None key as a list; they map to no column, so drop them
+    for line_no, row in enumerate(csv.DictReader(text_stream), start=2):
+        yield line_no, {k.strip().lower(): (v or '').strip() for k, v in row.items() if k is not None}
+
+def iter_ofx_rows(text_stream):
+    # OFX 1.x is SGML (closing tags optional) and banks often send it on one line, so walk the
+    # stream tag by tag; a record ends at </STMTTRN>, the next <STMTTRN>, or </BANKTRANLIST>
+    def record(fields):
+        return {'date': fields.get('dtposted', '')[:8], 'amount': fields.get('trnamt', ''), 'description': fields.get('name') or fields.get('memo', '')}
+    current, start_line = None, 0
+    for line_no, line in enumerate(text_stream, start=1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag in ('STMTTRN', 'BANKTRANLIST') and current is not None and (closing or tag == 'STMTTRN'):
+                yield start_line, record(current)
+                current = None
+            if tag == 'STMTTRN' and not closing: current, start_line = {}, line_no
+            elif current is not None and not closing and value.strip(): current[tag.lower()] = value.strip()
+    if current is not None: yield start_line, record(current)
+
+def validate_statement_rows(rows, errors, default_category=IMPORT_DEFAULT_CATEGORY):
+    for line_no, row in rows:
+        try:
+            raw_date = row.get('date', '')
+            date_obj = datetime.datetime.strptime(raw_date, '%Y%m%d' if raw_date.isdigit() else '%Y-%m-%d').date()
+            amount = float(row.get('amount', '').replace(',', ''))
+            if not math.isfinite(amount): raise ValueError(f"amount '{row.get('amount')}'")
+            tx_type = row.get('type', '').lower() or ('income' if amount >= 0 else 'expense')
+            if tx_type not in ('income', 'expense'): raise ValueError(f"type '{tx_type}'")
+            category = (row.get('category') or default_category)[:50]
+            debt_paid = (row.get('debt_paid') or None) if category == DEBT_PAYMENT_CATEGORY else None
+            yield {'date': date_obj, 'description': (row.get('description') or category)[:200], 'type': tx_type, 'category': category, 'amount': abs(amount), 'debt_paid': debt_paid and debt_paid[:100]}
+        except (ValueError, TypeError) as e:
+            errors.append(f"line {line_no}: {e}")
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)): yield chunk
+
+def _copy_transactions(rows):
+    # PostgreSQL only: COPY through the session's own connection, so it shares the session transaction
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for r in rows: writer.writerow([r['date'].isoformat(), r['description'], r['type'], r['category'], r['amount'], r['debt_paid'] if r['debt_paid'] is not None else '\\N', r['debt_id'] if r['debt_id'] is not None else '\\N', r['user_id']])
+    buffer.seek(0)
+    with db.session.connection().connection.dbapi_connection.cursor() as cursor:
+        cursor.copy_expert("COPY \"transaction\" (date, description, type, category, amount, debt_paid, debt_id, user_id) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+def import_transactions(user_id, text_stream, fmt='csv', chunk_size=IMPORT_CHUNK_SIZE):
+    """Stream a CSV/OFX statement into Transaction rows in one DB transaction.
+
+    Rows are inserted chunk by chunk (executemany, or COPY on PostgreSQL).
+    Debt balances and monthly rollups are adjusted once per debt/bucket at
+    the end. Returns (imported_count, errors); invalid rows are skipped.
+    """
+    errors, debt_totals, summary_totals, imported = [], {}, {}, 0
+    rows = iter_ofx_rows(text_stream) if fmt == 'ofx' else iter_csv_rows(text_stream)
+    use_copy = db.session.get_bind().dialect.name == 'postgresql'
+    debt_ids = {name: debt_id for debt_id, name in db.session.execute(db.select(Debt.id, Debt.name).where(Debt.user_id == user_id).order_by(Debt.id.desc()))}
+    try:
+        for chunk in chunked(validate_statement_rows(rows, errors), chunk_size):
+            for r in chunk:
+                r['user_id'] = user_id
+                r['debt_id'] = debt_ids.get(r['debt_paid'])
+                if r['debt_id']: debt_totals[r['debt_id']] = debt_totals.get(r['debt_id'], 0.0) + r['amount']
+                key = (r['date'].year, r['date'].month, r['type'], r['category'])
+                amount, count = summary_totals.get(key, (0.0, 0))
+                summary_totals[key] = (amount + r['amount'], count + 1)
+            if use_copy: _copy_transactions(chunk)
+            else: db.session.execute(db.insert(Transaction), chunk)
+            imported += len(chunk)
+        for debt_id, total in debt_totals.items():
+            Debt.query.filter_by(id=debt_id).update({Debt.current_balance: Debt.current_balance - total}, synchronize_session=False)
+        for (year, month, tx_type, category), (amount, count) in summary_totals.items():
+            apply_to_monthly_summary(user_id, datetime.date(year, month, 1), tx_type, category, amount, count)
+        bump_data_version(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return imported, errors
+
+def statement_format(filename, requested=None):
+    if requested in ('csv', 'ofx'): return requested
+    return 'ofx' if (filename or '').lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+# --- STREAMING EXPORT ---
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ('date', 'description', 'type', 'category', 'amount', 'debt_paid')
+
+def date_arg(name):
+    # request.args.get(type=...) turns a parse error into None, which would silently drop the filter; raise instead
+    raw = request.args.get(name)
+    return datetime.date.fromisoformat(raw) if raw else None
+
+def export_transactions_query(user_id, start_date=None, end_date=None, category=None, debt_id=None):
+    stmt = db.select(Transaction.date, Transaction.description, Transaction.type, Transaction.category, Transaction.amount, Transaction.debt_paid).where(Transaction.user_id == user_id)
+    if start_date: stmt = stmt.where(Transaction.date >= start_date)
+    if end_date: stmt = stmt.where(Transaction.date <= end_date)
+    if category: stmt = stmt.where(Transaction.category == category)
+    if debt_id: stmt = stmt.where(Transaction.debt_id == debt_id)
+    return stmt.order_by(Transaction.date, Transaction.id)
+
+def iter_export_chunks(stmt, fmt='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    # yield_per streams through a server-side cursor (stream_results) so only one chunk is ever in memory
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in result.partitions():
+            for row in rows: writer.writerow([row.date.isoformat(), row.description, row.type, row.category, f"{row.amount:.2f}", row.debt_paid or ''])
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for rows in result.partitions():
+            yield ''.join(json.dumps({'date': row.date.isoformat(), 'description': row.description, 'type': row.type, 'category': row.category, 'amount': row.amount, 'debt_paid': row.debt_paid}, ensure_ascii=False) + '\n' for row in rows)
+
+
+# --- JSON API HELPERS ---
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+def transaction_to_dict(tx):
+    return {'id': tx.id, 'date': tx.date.isoformat(), 'description': tx.description, 'type': tx.type, 'category': tx.category, 'amount': tx.amount, 'debt_paid': tx.debt_paid, 'debt_id': tx.debt_id}
+
+def debt_to_dict(debt):
+    return {'id': debt.id, 'name': debt.name, 'initial_balance': debt.initial_balance, 'current_balance': debt.current_balance, 'rate_percent': debt.rate_percent, 'rate_type': debt.rate_type, 'min_payment': debt.min_payment, 'due_day': debt.due_day}
+
+def encode_cursor(date, tx_id):
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{tx_id}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    date_part, id_part = raw.split('|')
+    return datetime.date.fromisoformat(date_part), int(id_part)
+
+
+# --- REFERENCE DATA CACHE (user record, debts, categories) ---
+class LocalCache:
+    """In-process LRU with per-entry TTL; each gunicorn worker has its own."""
+    shared = False
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]; return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize: self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock: self._entries.pop(key, None)
+
+class RedisCache:
+    """Redis-compatible store shared by all workers; errors degrade to cache misses."""
+    shared = True
+
+    def __init__(self, url, ttl=300, prefix='finance:'):
+        import redis  # optional: only needed when CACHE_URL points at redis
+        self.client, self.ttl, self.prefix = redis.Redis.from_url(url, socket_timeout=0.25), ttl, prefix
+        self._errors = redis.RedisError
+
+    def get(self, key):
+        try: raw = self.client.get(self.prefix + key)
+        except self._errors as e:
+            logging.getLogger('finance.cache').warning("cache get failed: %s", e); return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        try: self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl)
+        except self._errors as e: logging.getLogger('finance.cache').warning("cache set failed: %s", e)
+
+    def delete(self, key):
+        try: self.client.delete(self.prefix + key)
+        except self._errors as e: logging.getLogger('finance.cache').warning("cache delete failed: %s", e)
+
+def init_cache(app):
+    app.config.setdefault('CACHE_URL', os.environ.get('CACHE_URL'))
+    app.config.setdefault('CACHE_TTL', int(os.environ.get('CACHE_TTL', 300)))
+    app.config.setdefault('CACHE_MAXSIZE', int(os.environ.get('CACHE_MAXSIZE', 4096)))
+    app.config.setdefault('CACHE_VERSION_TTL', int(os.environ.get('CACHE_VERSION_TTL', 30)))
+    url = app.config['CACHE_URL']
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')): cache = RedisCache(url, app.config['CACHE_TTL'])
+    else: cache = LocalCache(app.config['CACHE_MAXSIZE'], app.config['CACHE_TTL'])
+    app.extensions['reference_cache'] = cache
+    return cache
+
+def cached_reference_data(user_id):
+    # Keyed by data version, so any write path that bumps it makes the old entry unreachable
+    cache = current_app.extensions['reference_cache']
+    key = f"ref:{user_id}:{current_data_version(user_id)}"
+    data = cache.get(key)
+    if data is None:
+        categories = {'income': [], 'expense': []}
+        for name, cat_type in db.session.execute(db.select(Category.name, Category.type).where(Category.user_id == user_id).order_by(Category.id)):
+            categories.setdefault(cat_type, []).append(name)
+        data = {'debts': [debt_to_dict(d) for d in Debt.query.filter_by(user_id=user_id).order_by(Debt.name).all()], 'categories': categories}
+        cache.set(key, data)
+    return data
+
+
+# --- TEMPLATE REGISTRY & FRAGMENT CACHE ---
+DASHBOARD_FRAGMENTS = ('year_options', 'debt_cards', 'debt_options', 'category_list', 'debt_modals')
+
+def init_templates(app, precompile=True):
+    # render_template_string() recompiles its source on every call; a DictLoader lets Jinja's
+    # template cache keep the compiled code, and get_template() here pays that cost at startup
+    app.jinja_loader = DictLoader(TEMPLATES)
+    if precompile:
+        for name in TEMPLATES: app.jinja_env.get_template(name)
+
+def render_fragment(name, user_id, context):
+    # Fragments only depend on reference data (and the date for due-day badges / year list)
+    cache = current_app.extensions['reference_cache']
+    key = f"frag:{user_id}:{current_data_version(user_id)}:{name}:{context['today'].isoformat()}:{context['current_year']}"
+    html = cache.get(key)
+    if html is None:
+        html = render_template(f'fragments/{name}.html', **context)
+        cache.set(key, html)
+    return Markup(html)
+
+def render_dashboard(user_id, **context):
+    fragments = {name: render_fragment(name, user_id, context) for name in DASHBOARD_FRAGMENTS}
+    return render_template('dashboard.html', fragments=fragments, **context)
+
+
+# --- OBSERVABILITY (per-request SQL stats + Prometheus metrics) ---
+sql_logger = logging.getLogger('finance.sql')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+class MetricsRegistry:
+    """Counters and histograms shared across gunicorn workers.
+
+    Each process keeps its own totals in memory and periodically writes them
+    to <directory>/<pid>-<token>.json; rendering sums every file, so totals
+    from restarted workers are kept and counters stay monotonic. Files of
+    exited workers are folded into aggregate.json at render time, so the
+    directory holds one file per live worker plus one.
+    """
+    AGGREGATE = 'aggregate.json'
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid, self._token = os.getpid(), uuid.uuid4().hex[:8]
+        self._counters, self._histograms, self._last_flush = {}, {}, 0.0
+
+    def _check_fork(self):
+        # a worker forked from a --preload master must not re-publish the master's numbers
+        if self._pid != os.getpid(): self._reset()
+
+    def inc(self, name, labels, value=1.0):
+        with self._lock:
+            self._check_fork()
+            series = self._counters.setdefault(name, {})
+            key = json.dumps(labels, sort_keys=True)
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            self._check_fork()
+            series = self._histograms.setdefault(name, {})
+            key = json.dumps(labels, sort_keys=True)
+            hist = series.setdefault(key, {'le': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(hist['le']):
+                if value <= bound: hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def flush(self, force=False):
+        with self._lock:
+            self._check_fork()
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.flush_interval: return
+            self._last_flush = now
+            payload = json.dumps({'counters': self._counters, 'histograms': self._histograms})
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self._pid}-{self._token}.json")
+        with open(path + '.tmp', 'w') as fh: fh.write(payload)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _merge(totals, data):
+        for name, series in data['counters'].items():
+            for key, value in series.items(): totals['counters'].setdefault(name, {})[key] = totals['counters'].get(name, {}).get(key, 0.0) + value
+        for name, series in data['histograms'].items():
+            for key, hist in series.items():
+                merged = totals['histograms'].setdefault(name, {}).setdefault(key, {'le': hist['le'], 'counts': [0] * len(hist['le']), 'sum': 0.0, 'count': 0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], hist['counts'])]
+                merged['sum'] += hist['sum']; merged['count'] += hist['count']
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.directory, filename)) as fh: return json.load(fh)
+        except (OSError, ValueError): return None
+
+    @staticmethod
+    def _pid_alive(pid):
+        try: os.kill(pid, 0)
+        except ProcessLookupError: return False
+        except PermissionError: pass
+        return True
+
+    def _compact_dead(self):
+        # Caller holds the directory lock. Write the aggregate before unlinking, so a crash
+        # in between can only over-count once rather than lose a dead worker's totals
+        dead = []
+        for filename in os.listdir(self.directory):
+            pid = filename.split('-', 1)[0]
+            if pid.isdigit() and not self._pid_alive(int(pid)): dead.append(filename)
+        if not dead: return
+        totals = self._read(self.AGGREGATE) or {'counters': {}, 'histograms': {}}
+        for filename in dead:
+            data = filename.endswith('.json') and self._read(filename)
+            if data: self._merge(totals, data)
+        path = os.path.join(self.directory, self.AGGREGATE)
+        with open(path + '.tmp', 'w') as fh: json.dump(totals, fh)
+        os.replace(path + '.tmp', path)
+        for filename in dead:
+            try: os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError: pass
+
+    def render(self):
+        self.flush(force=True)
+        totals = {'counters': {}, 'histograms': {}}
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            # serialise with other workers' renders so a file is never both compacted and summed
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._compact_dead()
+            for filename in sorted(os.listdir(self.directory)):
+                data = filename.endswith('.json') and self._read(filename)
+                if data: self._merge(totals, data)
+        counters, histograms = totals['counters'], totals['histograms']
+        lines = []
+        for name, series in sorted(counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_prometheus_labels(json.loads(key))} {value}" for key, value in sorted(series.items()))
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, hist in sorted(series.items()):
+                labels = json.loads(key)
+                for bound, count in zip(hist['le'], hist['counts']): lines.append(f"{name}_bucket{_prometheus_labels({**labels, 'le': str(bound)})} {count}")
+                lines.append(f"{name}_bucket{_prometheus_labels({**labels, 'le': '+Inf'})} {hist['count']}")
+                lines.append(f"{name}_sum{_prometheus_labels(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{_prometheus_labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+def _prometheus_labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}={json.dumps(str(v))}' for k, v in sorted(labels.items())) + '}'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(statement, time.perf_counter() - conn.info['query_start'].pop())
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_query_error(exception_context):
+    # after_cursor_execute never runs for a failing statement; drop its start time so it doesn't
+    # linger on the pooled connection, and still count the time it took
+    conn = exception_context.connection
+    if conn is None or not conn.info.get('query_start') or exception_context.statement is None: return
+    _record_query(exception_context.statement, time.perf_counter() - conn.info['query_start'].pop())
+
+def _record_query(statement, elapsed):
+    if not has_request_context(): return
+    stats = g.setdefault('sql_stats', {'count': 0, 'seconds': 0.0, 'shapes': Counter()})
+    stats['count'] += 1
+    stats['seconds'] += elapsed
+    stats['shapes'][statement] += 1
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        sql_logger.warning("slow query (%.1f ms) in %s: %s", elapsed * 1000, request.endpoint, ' '.join(statement.split())[:500])
+        current_app.extensions['metrics'].inc('db_slow_queries_total', {'endpoint': request.endpoint or 'unmatched'})
+
+def _remove_private_metrics_dir(directory, owner_pid):
+    # atexit handlers survive fork; only the process that created the directory removes it
+    if os.getpid() == owner_pid: shutil.rmtree(directory, ignore_errors=True)
+
+def init_instrumentation(app):
+    app.config.setdefault('SLOW_QUERY_MS', float(os.environ.get('SLOW_QUERY_MS', 100)))
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5)))
+    # gunicorn.conf.py gives each master a METRICS_DIR shared by its workers; without one
+    # (dev server, CLI) the process keeps its metrics in a private directory removed at exit
+    app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR'))
+    if not app.config['METRICS_DIR']:
+        app.config['METRICS_DIR'] = tempfile.mkdtemp(prefix='finance-tracker-metrics-')
+        atexit.register(_remove_private_metrics_dir, app.config['METRICS_DIR'], os.getpid())
+    metrics = app.extensions['metrics'] = MetricsRegistry(app.config['METRICS_DIR'])
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' not in g: return response
+        endpoint = request.endpoint or 'unmatched'
+        stats = g.get('sql_stats') or {'count': 0, 'seconds': 0.0, 'shapes': Counter()}
+        metrics.observe('http_request_duration_seconds', {'endpoint': endpoint, 'method': request.method}, time.perf_counter() - g.request_start)
+        metrics.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+        metrics.observe('db_queries_per_request', {'endpoint': endpoint}, stats['count'], QUERY_COUNT_BUCKETS)
+        metrics.inc('db_query_seconds_total', {'endpoint': endpoint}, stats['seconds'])
+        for statement, repeats in stats['shapes'].items():
+            if repeats >= app.config['N_PLUS_ONE_THRESHOLD']:
+                sql_logger.warning("possible N+1 in %s: statement ran %d times: %s", endpoint, repeats, ' '.join(statement.split())[:300])
+                metrics.inc('db_n_plus_one_total', {'endpoint': endpoint})
+        response.headers['Server-Timing'] = f"db;desc=\"{stats['count']} queries\";dur={stats['seconds'] * 1000:.1f}"
+        metrics.flush()
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# --- PASSWORD HASHING POOL ---
+DEFAULT_EXPENSE_CATEGORIES = ['อาหารและเครื่องดื่ม', 'เดินทาง', 'ที่อยู่อาศัย', 'ชำระหนี้', 'บันเทิง', 'ช้อปปิ้ง', 'สุขภาพ', 'การลงทุน']
+DEFAULT_INCOME_CATEGORIES = ['เงินเดือน', 'รายได้เสริม', 'โบนัส']
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing queue is full or a job times out; answered with 503."""
+
+class PasswordHasher:
+    """Runs pbkdf2 hashing/verification in a bounded process pool.
+
+    At most max_pending jobs may be queued or running per worker; beyond that
+    callers get HashPoolBusy immediately instead of piling up behind the CPU.
+    pool_size=0 hashes inline (useful for development). The executor is
+    created on first use, so a gunicorn --preload master never owns one.
+    """
+    def __init__(self, method, pool_size, max_pending, timeout):
+        self.method, self.pool_size, self.timeout = method, pool_size, timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor, self._pid = None, None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor, self._pid = ProcessPoolExecutor(max_workers=self.pool_size), os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        # A pool child died (e.g. OOM-killed) and the executor stays broken; the next call builds a new one
+        with self._lock:
+            if self._executor is executor: self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        if not self.pool_size: return fn(*args)
+        if not self._slots.acquire(blocking=False): raise HashPoolBusy()
+        try:
+            executor = self._pool()
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release(); self._discard(executor); raise HashPoolBusy()
+        except Exception:
+            self._slots.release(); raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try: return future.result(timeout=self.timeout)
+        except FutureTimeoutError: raise HashPoolBusy()
+        except BrokenProcessPool:
+            self._discard(executor); raise HashPoolBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # werkzeug stores "<method>$<salt>$<hash>", e.g. "pbkdf2:sha256:1000000$..."
+        return password_hash.split('$', 1)[0] != self.method
+
+    def hash_many(self, passwords, workers=None):
+        # Bulk provisioning: a throwaway pool over every core, outside the request-path limits
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            return list(pool.map(generate_password_hash, passwords, itertools.repeat(self.method), chunksize=16))
+
+def init_password_hasher(app):
+    app.config.setdefault('PASSWORD_HASH_ITERATIONS', int(os.environ.get('PASSWORD_HASH_ITERATIONS', DEFAULT_PBKDF2_ITERATIONS)))
+    app.config.setdefault('HASH_POOL_SIZE', int(os.environ.get('HASH_POOL_SIZE', min(2, os.cpu_count() or 1))))
+    app.config.setdefault('HASH_MAX_PENDING', int(os.environ.get('HASH_MAX_PENDING', 4 * max(app.config['HASH_POOL_SIZE'], 1))))
+    app.config.setdefault('HASH_TIMEOUT', float(os.environ.get('HASH_TIMEOUT', 5)))
+    hasher = app.extensions['password_hasher'] = PasswordHasher(f"pbkdf2:sha256:{app.config['PASSWORD_HASH_ITERATIONS']}", app.config['HASH_POOL_SIZE'], app.config['HASH_MAX_PENDING'], app.config['HASH_TIMEOUT'])
+
+    @app.errorhandler(HashPoolBusy)
+    def hash_pool_busy(e):
+        return "ระบบกำลังทำงานหนัก กรุณาลองใหม่อีกครั้ง", 503, {'Retry-After': '1'}
+    return hasher
+
+def create_users(rows, hasher, workers=None):
+    """Create users with default categories from (username, password) pairs; hashes in parallel."""
+    rows = [(u.strip(), pw) for u, pw in rows if u and u.strip() and pw]
+    existing = {name for (name,) in db.session.execute(db.select(User.username).where(User.username.in_([u for u, _ in rows])))} if rows else set()
+    fresh = list({u: pw for u, pw in rows if u not in existing}.items())
+    if not fresh: return 0, len(rows)  # re-run of an already provisioned file: no pool, no empty INSERT
+    hashes = hasher.hash_many([pw for _, pw in fresh], workers)
+    users = [User(username=u, password_hash=h) for (u, _), h in zip(fresh, hashes)]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.execute(db.insert(Category), [{'user_id': user.id, 'name': name, 'type': cat_type} for user in users
+                                             for cat_type, names in (('expense', DEFAULT_EXPENSE_CATEGORIES), ('income', DEFAULT_INCOME_CATEGORIES)) for name in names])
+    if users: db.session.execute(db.insert(DataVersion), [{'user_id': user.id, 'version': 1} for user in users])
+    db.session.commit()
+    return len(users), len(rows) - len(fresh)
+
+
+# --- STARTUP / FORK SAFETY ---
+def _dispose_engines_after_fork(app_ref):
+    # A child must not reuse the parent's pooled sockets; close=False leaves them to the parent
+    app = app_ref()
+    if app is None: return
+    with app.app_context():
+        for engine in db.engines.values(): engine.dispose(close=False)
+
 
 # --- 3. APPLICATION FACTORY FUNCTION ---
 def create_app():
@@ -79,14 +867,34 @@ def create_app():
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL or f"sqlite:///{os.path.join(os.path.dirname(__file__), 'local_dev.sqlite3')}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # FAST_STARTUP=1: skip the per-boot table check (run `flask --app app migrate-db` once per deploy instead)
+    # and compile templates on first render rather than at boot
+    fast_startup = os.environ.get('FAST_STARTUP', '').lower() in ('1', 'true', 'yes')
+    app.config['SCHEMA_CHECK_ON_STARTUP'] = not fast_startup
+    app.config['PRECOMPILE_TEMPLATES'] = not fast_startup
 
     # --- INITIALIZE EXTENSIONS WITH THE APP ---
     db.init_app(app)
     login_manager.init_app(app)
+    init_instrumentation(app)
+    init_cache(app)
+    init_templates(app, precompile=app.config['PRECOMPILE_TEMPLATES'])
+    hasher = init_password_hasher(app)
 
     # --- CREATE DATABASE TABLES IF THEY DON'T EXIST (For Render Free Tier) ---
     with app.app_context():
-        db.create_all()
+        if app.config['SCHEMA_CHECK_ON_STARTUP']:
+            # Only idempotent CREATE IF NOT EXISTS here: ALTERs and backfills race between workers and can outlast the
+            # worker boot timeout, so they live in migrate-db. A server must not start on a database that still needs them
+            # (queries would fail or totals read empty); the flask CLI loads the app too, and has to get through to run migrate-db
+            db.create_all()
+            if not schema_is_current():
+                message = "database schema is out of date; run `flask --app app migrate-db`"
+                if click.get_current_context(silent=True) is None: raise RuntimeError(message)
+                app.logger.warning(message)
+        # Drop connections opened at boot so a gunicorn --preload master hands workers an empty pool
+        for engine in db.engines.values(): engine.dispose()
+    if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=functools.partial(_dispose_engines_after_fork, weakref.ref(app)))
 
     # --- REGISTER BLUEPRINTS (กลุ่มของ Routes) ---
     from flask import Blueprint
@@ -97,11 +905,16 @@ def create_app():
         if current_user.is_authenticated: return redirect(url_for('main.index'))
         if request.method == 'POST':
             user = User.query.filter_by(username=request.form['username']).first()
-            if user and check_password_hash(user.password_hash, request.form['password']):
+            if user and hasher.verify(user.password_hash, request.form['password']):
+                if hasher.needs_rehash(user.password_hash):
+                    try:
+                        user.password_hash = hasher.hash(request.form['password'])
+                        db.session.commit()
+                    except HashPoolBusy: pass  # upgrade on a later login
                 login_user(user, remember=True)
                 return redirect(url_for('main.index'))
             flash('ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง', 'danger')
-        return render_template_string(AUTH_TEMPLATE, form_type='login')
+        return render_template('auth.html', form_type='login')
 
     @auth_bp.route('/register', methods=['GET', 'POST'])
     def register():
@@ -109,18 +922,17 @@ def create_app():
         if request.method == 'POST':
             if User.query.filter_by(username=request.form['username']).first():
                 flash('ชื่อผู้ใช้นี้มีคนใช้แล้ว', 'warning'); return redirect(url_for('auth.register'))
-            hashed_password = generate_password_hash(request.form['password'], method='pbkdf2:sha256')
+            hashed_password = hasher.hash(request.form['password'])
             new_user = User(username=request.form['username'], password_hash=hashed_password)
             db.session.add(new_user)
             db.session.commit()
-            default_expenses = ['อาหารและเครื่องดื่ม', 'เดินทาง', 'ที่อยู่อาศัย', 'ชำระหนี้', 'บันเทิง', 'ช้อปปิ้ง', 'สุขภาพ', 'การลงทุน']
-            default_incomes = ['เงินเดือน', 'รายได้เสริม', 'โบนัส']
-            for cat_name in default_expenses: db.session.add(Category(name=cat_name, type='expense', owner=new_user))
-            for cat_name in default_incomes: db.session.add(Category(name=cat_name, type='income', owner=new_user))
+            for cat_name in DEFAULT_EXPENSE_CATEGORIES: db.session.add(Category(name=cat_name, type='expense', owner=new_user))
+            for cat_name in DEFAULT_INCOME_CATEGORIES: db.session.add(Category(name=cat_name, type='income', owner=new_user))
+            bump_data_version(new_user.id)
             db.session.commit()
             flash('สมัครสมาชิกสำเร็จ! กรุณาเข้าสู่ระบบ', 'success')
             return redirect(url_for('auth.login'))
-        return render_template_string(AUTH_TEMPLATE, form_type='register')
+        return render_template('auth.html', form_type='register')
 
     @auth_bp.route('/logout')
     @login_required
@@ -136,33 +948,29 @@ def create_app():
         today = datetime.date.today()
         year = request.args.get('year', default=today.year, type=int)
         month = request.args.get('month', default=today.month, type=int)
-        start_date = datetime.date(year, month, 1)
-        end_day = (start_date.replace(day=28) + datetime.timedelta(days=4)).day
-        end_date = start_date.replace(day=end_day) if month != 2 else start_date.replace(day=28)
-        transactions = Transaction.query.filter_by(owner=current_user).filter(Transaction.date.between(start_date, end_date)).all()
-        total_income = sum(t.amount for t in transactions if t.type == 'income')
-        total_expense = sum(t.amount for t in transactions if t.type == 'expense')
-        expense_by_category = db.session.query(Transaction.category, db.func.sum(Transaction.amount)).filter_by(owner=current_user, type='expense').filter(Transaction.date.between(start_date, end_date)).group_by(Transaction.category).all()
+        buckets = MonthlySummary.query.filter_by(user_id=current_user.id, year=year, month=month).filter(MonthlySummary.tx_count > 0).order_by(MonthlySummary.category).all()
+        total_income = sum(b.total for b in buckets if b.type == 'income')
+        total_expense = sum(b.total for b in buckets if b.type == 'expense')
+        expense_by_category = [(b.category, b.total) for b in buckets if b.type == 'expense']
         summary = {'total_income': total_income, 'total_expense': total_expense, 'net_balance': total_income - total_expense, 'expense_by_category_json': json.dumps({'labels': [c[0] for c in expense_by_category], 'data': [float(c[1]) for c in expense_by_category]})}
         all_years = list(range(today.year - 5, today.year + 2))
         data = {
             'transactions': Transaction.query.filter_by(owner=current_user).order_by(Transaction.date.desc()).limit(15).all(),
-            'debts': Debt.query.filter_by(owner=current_user).order_by(Debt.name).all(),
-            'categories': {
-                'income': [c.name for c in Category.query.filter_by(owner=current_user, type='income').all()],
-                'expense': [c.name for c in Category.query.filter_by(owner=current_user, type='expense').all()]
-            }
+            **cached_reference_data(current_user.id),
         }
-        return render_template_string(HTML_TEMPLATE, data=data, summary=summary, current_year=year, current_month=month, all_years=all_years, today=today)
+        return render_dashboard(current_user.id, data=data, summary=summary, current_year=year, current_month=month, all_years=all_years, today=today)
 
     @main_bp.route('/debt/<int:debt_id>')
     @login_required
     def debt_detail(debt_id):
         debt = Debt.query.get_or_404(debt_id)
         if debt.user_id != current_user.id: abort(403)
-        payment_history = Transaction.query.filter(Transaction.user_id==current_user.id, Transaction.category=='ชำระหนี้', Transaction.debt_paid==debt.name).order_by(Transaction.date.desc()).all()
-        total_paid = sum(tx.amount for tx in payment_history)
-        return render_template_string(DEBT_DETAIL_TEMPLATE, debt=debt, payment_history=payment_history, total_paid=total_paid, today=datetime.date.today())
+        page = request.args.get('page', default=1, type=int)
+        history_filter = (Transaction.user_id==current_user.id, Transaction.debt_id==debt.id)
+        total_paid, payment_count = db.session.query(db.func.coalesce(db.func.sum(Transaction.amount), 0.0), db.func.count(Transaction.id)).filter(*history_filter).one()
+        pagination = Transaction.query.filter(*history_filter).order_by(Transaction.date.desc(), Transaction.id.desc()).paginate(page=page, per_page=DEBT_HISTORY_PAGE_SIZE, error_out=False, count=False)
+        pagination.total = payment_count
+        return render_template('debt_detail.html', debt=debt, payment_history=pagination.items, pagination=pagination, total_paid=total_paid, today=datetime.date.today())
 
     @main_bp.route('/add_transaction', methods=['POST'])
     @login_required
@@ -170,14 +978,17 @@ def create_app():
         try:
             date_obj = datetime.datetime.strptime(request.form['date'], '%Y-%m-%d').date()
             amount = float(request.form['amount'])
-            debt_paid_name = request.form.get('debt_paid') if request.form.get('category') == 'ชำระหนี้' else None
-            new_tx = Transaction(date=date_obj, description=request.form['description'], type=request.form['type'], category=request.form['category'], amount=amount, debt_paid=debt_paid_name, owner=current_user)
+            debt = None
+            if request.form.get('category') == DEBT_PAYMENT_CATEGORY:
+                if request.form.get('debt_id', type=int): debt = Debt.query.filter_by(id=request.form.get('debt_id', type=int), user_id=current_user.id).first()
+                elif request.form.get('debt_paid'): debt = Debt.query.filter_by(name=request.form['debt_paid'], user_id=current_user.id).first()
+            new_tx = Transaction(date=date_obj, description=request.form['description'], type=request.form['type'], category=request.form['category'], amount=amount, debt_paid=debt.name if debt else None, debt_id=debt.id if debt else None, owner=current_user)
             db.session.add(new_tx)
-            if debt_paid_name:
-                debt = Debt.query.filter_by(name=debt_paid_name, owner=current_user).first()
-                if debt:
-                    debt.current_balance -= amount
-                    flash(f"ยอดหนี้ '{debt.name}' อัปเดตแล้ว!", "info")
+            apply_to_monthly_summary(current_user.id, date_obj, new_tx.type, new_tx.category, amount)
+            if debt:
+                debt.current_balance -= amount
+                flash(f"ยอดหนี้ '{debt.name}' อัปเดตแล้ว!", "info")
+            bump_data_version(current_user.id)
             db.session.commit()
             flash("เพิ่มรายการสำเร็จ!", "success")
         except Exception as e:
@@ -192,6 +1003,7 @@ def create_app():
             balance = float(request.form['balance'])
             new_debt = Debt(name=request.form['name'], initial_balance=balance, current_balance=balance, rate_percent=float(request.form['rate_percent']), rate_type=request.form['rate_type'], min_payment=float(request.form['min_payment']), due_day=int(request.form['due_day']), owner=current_user)
             db.session.add(new_debt)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash(f"เพิ่มหนี้ '{new_debt.name}' สำเร็จ", "success")
         except Exception as e:
@@ -212,6 +1024,8 @@ def create_app():
             debt.rate_type = request.form['rate_type']
             debt.min_payment = float(request.form['min_payment'])
             debt.due_day = int(request.form['due_day'])
+            Transaction.query.filter_by(user_id=current_user.id, debt_id=debt.id).update({Transaction.debt_paid: debt.name}, synchronize_session=False)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash(f"แก้ไขข้อมูลหนี้ '{debt.name}' สำเร็จ", "success")
         except Exception as e:
@@ -225,12 +1039,14 @@ def create_app():
         tx = Transaction.query.get_or_404(tx_id)
         if tx.user_id != current_user.id: abort(403)
         try:
-            if tx.category == 'ชำระหนี้' and tx.debt_paid:
-                debt = Debt.query.filter_by(name=tx.debt_paid, owner=current_user).first()
+            if tx.debt_id:
+                debt = db.session.get(Debt, tx.debt_id)
                 if debt:
                     debt.current_balance += tx.amount
                     flash(f"คืนยอดเงินให้หนี้ '{debt.name}' เรียบร้อย", "info")
+            apply_to_monthly_summary(tx.user_id, tx.date, tx.type, tx.category, -tx.amount, count=-1)
             db.session.delete(tx)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash("ลบรายการสำเร็จ!", "success")
         except Exception as e:
@@ -246,6 +1062,7 @@ def create_app():
             exists = Category.query.filter_by(name=new_cat, type=cat_type, owner=current_user).first()
             if new_cat and not exists:
                 db.session.add(Category(name=new_cat, type=cat_type, owner=current_user))
+                bump_data_version(current_user.id)
                 db.session.commit()
                 flash(f"เพิ่มหมวดหมู่ '{new_cat}' สำเร็จ", "success")
             else: flash(f"หมวดหมู่ '{new_cat}' อาจมีอยู่แล้ว", "warning")
@@ -254,6 +1071,35 @@ def create_app():
             flash(f"เกิดข้อผิดพลาด: {e}", "danger")
         return redirect(request.referrer or url_for('main.index'))
 
+    @main_bp.route('/import_transactions', methods=['POST'])
+    @login_required
+    def import_transactions_view():
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash("กรุณาเลือกไฟล์", "warning"); return redirect(url_for('main.index'))
+        try:
+            text_stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            imported, errors = import_transactions(current_user.id, text_stream, statement_format(upload.filename, request.form.get('format')))
+            flash(f"นำเข้าสำเร็จ {imported} รายการ", "success")
+            if errors: flash(f"ข้ามไป {len(errors)} แถว: " + "; ".join(errors[:5]), "warning")
+        except Exception as e:
+            flash(f"นำเข้าไม่สำเร็จ: {e}", "danger")
+        return redirect(url_for('main.index'))
+
+    @main_bp.route('/export_transactions')
+    @login_required
+    def export_transactions():
+        fmt = request.args.get('format', 'csv')
+        if fmt not in ('csv', 'jsonl'): abort(400)
+        try:
+            start_date, end_date = date_arg('start'), date_arg('end')
+            debt_id = int(request.args['debt_id']) if request.args.get('debt_id') else None
+        except ValueError: abort(400)
+        stmt = export_transactions_query(current_user.id, start_date, end_date, request.args.get('category') or None, debt_id)
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        filename = f"transactions.{fmt}"
+        return Response(stream_with_context(iter_export_chunks(stmt, fmt)), mimetype=f"{mimetype}; charset=utf-8", headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
     @main_bp.route('/calculate_debt', methods=['POST'])
     @login_required
     def calculate_debt():
@@ -266,17 +1112,162 @@ def create_app():
             return jsonify({'debt_name': debt.name, 'duration': duration, 'payoff_date': payoff_date})
         except Exception: return jsonify({'error': 'ข้อมูลไม่ถูกต้อง'}), 400
 
+    @main_bp.route('/calculate_debts', methods=['POST'])
+    @login_required
+    def calculate_debts():
+        try:
+            strategy = request.form.get('strategy', 'avalanche')
+            extra_payment = float(request.form.get('extra_payment', 0))
+            query = Debt.query.filter_by(owner=current_user).filter(Debt.current_balance > 0)
+            debt_ids = [int(i) for i in request.form.getlist('debt_id')]
+            if debt_ids: query = query.filter(Debt.id.in_(debt_ids))
+            debts = query.order_by(Debt.id).all()
+            schedule = simulate_debt_payoff(debts, strategy, extra_payment)
+        except ValueError: return jsonify({'error': 'ข้อมูลไม่ถูกต้อง'}), 400
+        import numpy as np
+        today = datetime.date.today()
+        months = schedule['balance'].shape[0]
+        results = []
+        for i, debt in enumerate(debts):
+            paid_off = np.flatnonzero(schedule['balance'][:, i] <= 0)
+            payoff_month = int(paid_off[0]) + 1 if paid_off.size else None
+            results.append({
+                'debt_id': debt.id, 'debt_name': debt.name, 'payoff_month': payoff_month,
+                'payoff_date': add_months(today, payoff_month).strftime('%d-%m-%Y') if payoff_month else None,
+                'total_interest': round(float(schedule['interest'][:, i].sum()), 2),
+                'schedule': {key: np.round(schedule[key][:, i], 2).tolist() for key in ('balance', 'interest', 'principal', 'payment')},
+            })
+        all_paid = all(r['payoff_month'] for r in results)
+        return jsonify({'strategy': strategy, 'extra_payment': extra_payment, 'months': months if all_paid else None, 'paid_off': all_paid,
+                        'total_interest': round(float(schedule['interest'].sum()), 2), 'debts': results})
+
     app.register_blueprint(main_bp)
+
+    api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+    def versioned_json(build):
+        # ETag = user + data version + day + query string; a match skips every data query
+        version = current_data_version(current_user.id)
+        etag = hashlib.sha1(f"{current_user.id}:{version}:{datetime.date.today()}:{request.full_path}".encode()).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = jsonify(build())
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @api_bp.route('/transactions')
+    @login_required
+    def transactions():
+        limit = max(1, min(request.args.get('limit', default=API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+        try: after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except (ValueError, UnicodeDecodeError): return jsonify({'error': 'cursor ไม่ถูกต้อง'}), 400
+        try:
+            start_date, end_date = date_arg('start'), date_arg('end')
+            debt_id = int(request.args['debt_id']) if request.args.get('debt_id') else None
+        except ValueError: return jsonify({'error': 'ตัวกรองไม่ถูกต้อง'}), 400
+        def build():
+            query = Transaction.query.filter_by(user_id=current_user.id)
+            for field in ('type', 'category'):
+                if request.args.get(field): query = query.filter(getattr(Transaction, field) == request.args[field])
+            if start_date: query = query.filter(Transaction.date >= start_date)
+            if end_date: query = query.filter(Transaction.date <= end_date)
+            if debt_id: query = query.filter(Transaction.debt_id == debt_id)
+            if after:
+                query = query.filter(db.or_(Transaction.date < after[0], db.and_(Transaction.date == after[0], Transaction.id < after[1])))
+            rows = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit + 1).all()
+            items = rows[:limit]
+            return {'items': [transaction_to_dict(tx) for tx in items], 'next_cursor': encode_cursor(items[-1].date, items[-1].id) if len(rows) > limit else None}
+        return versioned_json(build)
+
+    @api_bp.route('/summary')
+    @login_required
+    def summary():
+        today = datetime.date.today()
+        year = request.args.get('year', default=today.year, type=int)
+        month = request.args.get('month', default=today.month, type=int)
+        def build():
+            buckets = MonthlySummary.query.filter_by(user_id=current_user.id, year=year, month=month).filter(MonthlySummary.tx_count > 0).order_by(MonthlySummary.category).all()
+            total_income = sum(b.total for b in buckets if b.type == 'income')
+            total_expense = sum(b.total for b in buckets if b.type == 'expense')
+            return {'year': year, 'month': month, 'total_income': total_income, 'total_expense': total_expense, 'net_balance': total_income - total_expense,
+                    'expense_by_category': [{'category': b.category, 'total': b.total, 'count': b.tx_count} for b in buckets if b.type == 'expense'],
+                    'income_by_category': [{'category': b.category, 'total': b.total, 'count': b.tx_count} for b in buckets if b.type == 'income']}
+        return versioned_json(build)
+
+    @api_bp.route('/debts')
+    @login_required
+    def debts():
+        return versioned_json(lambda: {'items': cached_reference_data(current_user.id)['debts']})
+
+    app.register_blueprint(api_bp)
+    login_manager.blueprint_login_views['api'] = None  # 401 instead of a redirect to the login page
+
+    # --- CLI COMMANDS ---
+    @app.cli.command('rebuild-summaries')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user.')
+    def rebuild_summaries_command(user_id):
+        """Rebuild the MonthlySummary rollup table from all transactions."""
+        count = rebuild_monthly_summaries(user_id)
+        click.echo(f"rebuilt {count} monthly summary rows")
+
+    @app.cli.command('migrate-db')
+    def migrate_db_command():
+        """Create missing tables/columns/indexes and backfill Transaction.debt_id."""
+        backfilled = migrate_schema()
+        click.echo(f"schema up to date ({backfilled} debt payments linked)")
+
+    @app.cli.command('provision-users')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--workers', type=int, default=None, help='Hashing processes (default: all cores).')
+    def provision_users_command(path, workers):
+        """Create users from a username,password CSV, hashing passwords in parallel."""
+        with open(path, encoding='utf-8-sig', newline='') as fh:
+            rows = [(row.get('username', ''), row.get('password', '')) for row in csv.DictReader(fh)]
+        created, skipped = create_users(rows, hasher, workers)
+        click.echo(f"created {created} users ({skipped} already existed)")
+
+    @app.cli.command('import-transactions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--username', required=True)
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ofx']), default=None)
+    @click.option('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, show_default=True)
+    def import_transactions_command(path, username, fmt, chunk_size):
+        """Bulk import a CSV/OFX bank statement for one user."""
+        user = User.query.filter_by(username=username).first()
+        if user is None: raise click.ClickException(f"no such user: {username}")
+        with open(path, encoding='utf-8-sig', newline='') as fh:
+            imported, errors = import_transactions(user.id, fh, statement_format(path, fmt), chunk_size)
+        for error in errors: click.echo(f"skipped {error}", err=True)
+        click.echo(f"imported {imported} transactions ({len(errors)} skipped)")
     
     return app
 
-# --- CREATE APP INSTANCE FOR GUNICORN & LOCAL RUN ---
-app = create_app()
-
 # --- HTML TEMPLATES ---
 AUTH_TEMPLATE = """<!DOCTYPE html><html lang="th"><head><meta charset="UTF-8"><title>{{'เข้าสู่ระบบ' if form_type=='login' else 'สมัครสมาชิก'}}</title><link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"><style>body{display:flex;align-items:center;padding-top:40px;padding-bottom:40px;background-color:#f5f5f5;height:100vh}.form-signin{width:100%;max-width:330px;padding:15px;margin:auto}</style></head><body class="text-center"><main class="form-signin"><form method="POST" action=""><h1 class="h3 mb-3 fw-normal">{{'กรุณาเข้าสู่ระบบ' if form_type=='login' else 'สร้างบัญชีใหม่'}}</h1>{% with messages=get_flashed_messages(with_categories=true)%}{% if messages%}{% for category,message in messages%}<div class="alert alert-{{category}}">{{message}}</div>{% endfor%}{% endif%}{% endwith %}<div class="form-floating"><input type="text" name="username" class="form-control" id="floatingInput" placeholder="Username" required><label for="floatingInput">ชื่อผู้ใช้</label></div><div class="form-floating"><input type="password" name="password" class="form-control" id="floatingPassword" placeholder="Password" required><label for="floatingPassword">รหัสผ่าน</label></div><button class="w-100 btn btn-lg btn-primary mt-3" type="submit">{{'เข้าสู่ระบบ' if form_type=='login' else 'สมัครสมาชิก'}}</button><p class="mt-3">{% if form_type=='login'%}ยังไม่มีบัญชี? <a href="{{url_for('auth.register')}}">สมัครสมาชิก</a>{% else %}มีบัญชีอยู่แล้ว? <a href="{{url_for('auth.login')}}">เข้าสู่ระบบ</a>{% endif %}</p></form></main></body></html>"""
-HTML_TEMPLATE = """<!DOCTYPE html><html lang="th" data-bs-theme="light"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Finance Dashboard</title><link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css"><link href="https://fonts.googleapis.com/css2?family=Sarabun:wght@400;500;700&display=swap" rel="stylesheet"><style>body{font-family:'Sarabun',sans-serif;background-color:#f0f2f5}.card{border:none;border-radius:.8rem;box-shadow:0 4px 12px rgba(0,0,0,.08);overflow:hidden}.debt-card{transition:transform .2s ease-in-out}.debt-card:hover{transform:translateY(-5px);box-shadow:0 8px 20px rgba(0,0,0,.12)}.table-responsive{max-height:65vh}.net-positive{color:#198754!important}.net-negative{color:#dc3545!important}.sticky-top{top:1rem}a{text-decoration:none}</style></head><body><div class="container-fluid p-4"><header class="d-flex justify-content-between align-items-center mb-4"><h1 class="h3 mb-0"><i class="bi bi-wallet2 me-2"></i>Finance Dashboard <small class="text-muted h6">({{ current_user.username }})</small></h1><div><button class="btn btn-primary" data-bs-toggle="modal" data-bs-target="#addTransactionModal"><i class="bi bi-plus-circle me-1"></i> เพิ่มรายการ</button><button class="btn btn-warning text-dark" data-bs-toggle="modal" data-bs-target="#addDebtModal"><i class="bi bi-credit-card me-1"></i> เพิ่มหนี้สิน</button><a href="{{ url_for('auth.logout') }}" class="btn btn-outline-secondary"><i class="bi bi-box-arrow-right me-1"></i> ออกจากระบบ</a></div></header>{% with messages = get_flashed_messages(with_categories=true) %}{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }} alert-dismissible fade show" role="alert">{{ message }}<button type="button" class="btn-close" data-bs-dismiss="alert"></button></div>{% endfor %}{% endif %}{% endwith %}<div class="row g-4"><div class="col-lg-4"><div class="sticky-top"><div class="card mb-4"><div class="card-body"><h5 class="card-title mb-3"><i class="bi bi-bar-chart-line me-2"></i>สรุปภาพรวม</h5><form method="GET" action="{{url_for('main.index')}}" class="d-flex gap-2 mb-3"><select name="month" class="form-select form-select-sm">{% for i in range(1,13) %}<option value="{{i}}" {% if i==current_month %}selected{% endif %}>เดือน {{i}}</option>{% endfor %}</select><select name="year" class="form-select form-select-sm">{% for y in all_years %}<option value="{{y}}" {% if y==current_year %}selected{% endif %}>{{y}}</option>{% endfor %}</select><button type="submit" class="btn btn-sm btn-outline-primary"><i class="bi bi-search"></i></button></form><div class="d-flex justify-content-around text-center"><div><small class="text-muted">รายรับ</small><p class="h5 net-positive mb-0">{{ "%.2f"|format(summary.total_income) }}</p></div><div><small class="text-muted">รายจ่าย</small><p class="h5 net-negative mb-0">{{ "%.2f"|format(summary.total_expense) }}</p></div><div><small class="text-muted">คงเหลือ</small><p class="h5 {{'net-positive' if summary.net_balance >=0 else 'net-negative'}} mb-0">{{ "%.2f"|format(summary.net_balance) }}</p></div></div></div></div><div class="card"><div class="card-body"><h5 class="card-title mb-3"><i class="bi bi-pie-chart me-2"></i>สัดส่วนรายจ่าย</h5><div style="height:300px"><canvas id="expenseChart"></canvas></div></div></div></div></div><div class="col-lg-8"><h4 class="mb-3"><i class="bi bi-journal-text me-2"></i>ติดตามหนี้สิน</h4><div class="row g-4">{% if data.debts %}{% for debt in data.debts %}<div class="col-md-6"><div class="card debt-card h-100"><div class="card-body position-relative"><div class="d-flex justify-content-between align-items-start mb-2"><a href="{{url_for('main.debt_detail',debt_id=debt.id)}}" class="text-dark stretched-link"><h5 class="card-title mb-1">{{debt.name}}</h5></a><button class="btn btn-sm btn-outline-secondary border-0" data-bs-toggle="modal" data-bs-target="#editDebtModal-{{debt.id}}" style="z-index:5" onclick="event.stopPropagation();"><i class="bi bi-pencil-square"></i></button></div><p class="h3 mb-1">฿{{ "%.2f"|format(debt.current_balance) }}</p><small class="text-muted">จาก {{ "%.2f"|format(debt.initial_balance) }}</small><div class="progress mt-2 mb-3" role="progressbar" style="height:5px"><div class="progress-bar bg-success" style="width:{{(100-(debt.current_balance/debt.initial_balance*100)) if debt.initial_balance>0 else 0}}%"></div></div><p class="small text-muted mb-0"><i class="bi bi-calendar-check me-1"></i>ครบกำหนดวันที่ {{debt.due_day}}{% set days_left=debt.due_day-today.day %}{% if 0<=days_left<=5 %}<span class="badge bg-danger-subtle text-danger-emphasis rounded-pill ms-2">อีก {{days_left}} วัน</span>{% endif %}</p></div></div></div>{% endfor %}{% else %}<p class="text-center text-muted">ยังไม่มีข้อมูลหนี้สิน</p>{% endif %}</div><div class="card mt-4"><div class="card-header bg-white d-flex justify-content-between align-items-center"><h5 class="mb-0"><i class="bi bi-list-ul me-2"></i>ประวัติรายการล่าสุด</h5><button class="btn btn-sm btn-outline-secondary" data-bs-toggle="modal" data-bs-target="#addCategoryModal"><i class="bi bi-tag-fill me-1"></i>จัดการหมวดหมู่</button></div><div class="table-responsive"><table class="table table-hover mb-0 align-middle"><tbody>{% for tx in data.transactions %}<tr><td class="ps-3"><i class="bi h5 mb-0 {{'bi-arrow-down-circle-fill text-success' if tx.type=='income' else 'bi-arrow-up-circle-fill text-danger'}}"></i></td><td>{{tx.date.strftime('%Y-%m-%d')}}</td><td><strong>{{tx.description}}</strong><br><small class="text-muted">{{tx.category}}</small></td><td class="text-end fw-bold {{'net-positive' if tx.type=='income' else 'net-negative'}}">{{('+' if tx.type=='income' else '-')~"%.2f"|format(tx.amount)}}</td><td class="text-end pe-3"><form action="{{url_for('main.delete_transaction',tx_id=tx.id)}}" method="POST" onsubmit="return confirm('แน่ใจหรือไม่?')"><button type="submit" class="btn btn-sm border-0"><i class="bi bi-x-lg text-muted"></i></button></form></td></tr>{% endfor %}</tbody></table></div></div></div></div></div><div class="modal fade" id="addTransactionModal" tabindex="-1"><div class="modal-dialog modal-lg"><div class="modal-content"><form action="{{url_for('main.add_transaction')}}" method="POST"><div class="modal-header"><h5 class="modal-title">เพิ่มรายการ</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="row"><div class="col-md-6"><div class="mb-3"><input type="date" name="date" class="form-control" value="{{today.strftime('%Y-%m-%d')}}" required></div><div class="mb-3"><input type="text" name="description" class="form-control" placeholder="รายการ" required></div><div class="mb-3"><select name="type" class="form-select" id="transactionType"><option value="expense">รายจ่าย</option><option value="income">รายรับ</option></select></div><div class="mb-3"><label class="form-label">หมวดหมู่</label><select name="category" id="category-select" class="form-select" required></select></div><div class="mb-3" id="debt-payment-field" style="display:none"><label class="form-label">ชำระหนี้สำหรับ</label><select name="debt_paid" class="form-select"><option value="">-- ไม่ระบุ --</option>{% for debt in data.debts %}<option value="{{debt.name}}">{{debt.name}}</option>{% endfor %}</select></div><div class="mb-3"><label class="form-label">จำนวนเงินรวม</label><input type="number" step="0.01" name="amount" id="totalAmount" class="form-control" placeholder="0.00" required></div></div><div class="col-md-6 border-start"><h6><i class="bi bi-receipt"></i> เครื่องคิดเลขรายการย่อย</h6><div id="item-list"></div><button type="button" class="btn btn-sm btn-outline-secondary" id="addItemBtn"><i class="bi bi-plus-lg"></i> เพิ่มรายการย่อย</button></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div><div class="modal fade" id="addCategoryModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_category')}}" method="POST"><div class="modal-header"><h5 class="modal-title">จัดการหมวดหมู่</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><label class="form-label">ประเภท</label><select name="type" class="form-select"><option value="expense">รายจ่าย</option><option value="income">รายรับ</option></select></div><div class="mb-3"><label class="form-label">ชื่อหมวดหมู่ใหม่</label><input type="text" name="name" class="form-control" required></div><button type="submit" class="btn btn-primary w-100">เพิ่มหมวดหมู่</button><hr><p>หมวดหมู่ที่มีอยู่:</p><ul class="list-group">{% for cat in data.categories.expense %}<li class="list-group-item">{{cat}} (รายจ่าย)</li>{% endfor %}{% for cat in data.categories.income %}<li class="list-group-item">{{cat}} (รายรับ)</li>{% endfor %}</ul></div></form></div></div></div><div class="modal fade" id="addDebtModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_debt')}}" method="POST"><div class="modal-header"><h5 class="modal-title">เพิ่มหนี้สิน</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><input type="text" name="name" class="form-control" placeholder="ชื่อหนี้" required></div><div class="mb-3"><input type="number" step="0.01" name="balance" class="form-control" placeholder="ยอดหนี้ทั้งหมด" required></div><div class="row g-2 mb-3"><div class="col-8"><input type="number" step="0.01" name="rate_percent" class="form-control" placeholder="อัตราดอกเบี้ย" required></div><div class="col-4"><select name="rate_type" class="form-select"><option value="yearly">ต่อปี</option><option value="monthly">ต่อเดือน</option></select></div></div><div class="row g-2 mb-3"><div class="col-8"><input type="number" step="0.01" name="min_payment" class="form-control" placeholder="ชำระขั้นต่ำ/เดือน" required></div><div class="col-4"><div class="input-group"><input type="number" name="due_day" class="form-control" placeholder="วันที่" value="1" min="1" max="31" required></div></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-warning text-dark">เพิ่มหนี้</button></div></form></div></div></div>{% for debt in data.debts %}<div class="modal fade" id="editDebtModal-{{debt.id}}" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.edit_debt',debt_id=debt.id)}}" method="POST"><div class="modal-header"><h5 class="modal-title">แก้ไขหนี้: {{debt.name}}</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><label class="form-label">ชื่อหนี้</label><input type="text" name="name" class="form-control" value="{{debt.name}}" required></div><div class="row g-2 mb-3"><div class="col"><label class="form-label">ยอดตั้งต้น</label><input type="number" step="0.01" name="initial_balance" value="{{debt.initial_balance}}" class="form-control" required></div><div class="col"><label class="form-label">ยอดปัจจุบัน</label><input type="number" step="0.01" name="current_balance" value="{{debt.current_balance}}" class="form-control" required></div></div><div class="row g-2 mb-3"><div class="col-8"><label class="form-label">ดอกเบี้ย</label><input type="number" step="0.01" name="rate_percent" value="{{debt.rate_percent}}" class="form-control" required></div><div class="col-4"><label class="form-label"> </label><select name="rate_type" class="form-select"><option value="yearly" {% if debt.rate_type=='yearly'%}selected{% endif %}>ต่อปี</option><option value="monthly" {% if debt.rate_type=='monthly'%}selected{% endif %}>ต่อเดือน</option></select></div></div><div class="row g-2 mb-3"><div class="col-8"><label class="form-label">ขั้นต่ำ/เดือน</label><input type="number" step="0.01" name="min_payment" value="{{debt.min_payment}}" class="form-control" required></div><div class="col-4"><label class="form-label">วันครบกำหนด</label><input type="number" name="due_day" class="form-control" value="{{debt.due_day}}" min="1" max="31" required></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ยกเลิก</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div>{% endfor %}<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script><script src="https://cdn.jsdelivr.net/npm/chart.js"></script><script>document.addEventListener('DOMContentLoaded',function(){const e={{summary.expense_by_category_json|safe}},t=document.getElementById("expenseChart");t&&e&&e.labels&&e.labels.length>0?new Chart(t,{type:"doughnut",data:{labels:e.labels,datasets:[{data:e.data,backgroundColor:["#ff6384","#36a2eb","#ffce56","#4bc0c0","#9966ff","#ff9f40","#c9cbcf"],borderColor:"#fff",borderWidth:2,hoverOffset:8}]},options:{responsive:!0,maintainAspectRatio:!1,animation:{animateScale:!0,animateRotate:!0},plugins:{legend:{position:"bottom",labels:{usePointStyle:!0,padding:20,font:{family:"Sarabun"}}},tooltip:{yAlign:"bottom",displayColors:!1,bodyFont:{family:"Sarabun"},titleFont:{family:"Sarabun"},callbacks:{label:function(e){let t=e.label||"",a=e.raw,l=e.chart.getDatasetMeta(0).total,o=(a/l*100).toFixed(2)+"%";return`${t} ${new Intl.NumberFormat("th-TH",{style:"currency",currency:"THB"}).format(a)} (${o})`}}}}}}):t&&(t.getContext("2d").textAlign="center",t.getContext("2d").textBaseline="middle",t.getContext("2d").font="16px 'Sarabun'",t.getContext("2d").fillStyle="#6c757d",t.getContext("2d").fillText("ไม่มีข้อมูลรายจ่ายในเดือนนี้",t.canvas.width/2,50));const a={{data.categories|tojson|safe}},l=document.getElementById("category-select"),o=document.getElementById("transactionType"),n=document.getElementById("debt-payment-field"),d=()=>{n&&(n.style.display="expense"===o.value&&"ชำระหนี้"===l.value?"block":"none")},c=e=>{if(!l||!a)return;l.innerHTML="";const t=a[e]||[];t.forEach(e=>{const t=document.createElement("option");t.value=e,t.textContent=e,l.appendChild(t)}),d()};o&&o.addEventListener("change",()=>c(o.value)),l&&l.addEventListener("change",d),o&&c(o.value);const i=document.getElementById("item-list"),s=document.getElementById("totalAmount"),r=document.getElementById("addItemBtn");function m(){if(!s)return;let e=0;document.querySelectorAll(".item-price").forEach(t=>{e+=parseFloat(t.value)||0}),s.value=e.toFixed(2)}r&&r.addEventListener("click",()=>{if(!i)return;const e=document.createElement("div");e.className="d-flex gap-2 mb-2 item-row",e.innerHTML=`<input type="text" class="form-control form-control-sm" placeholder="ชื่อของ"><input type="number" step="0.01" class="form-control form-control-sm item-price" placeholder="ราคา"><button type="button" class="btn btn-sm btn-outline-danger" onclick="this.closest('.item-row').remove();m();">X</button>`,i.appendChild(e),e.querySelector(".item-price").addEventListener("input",m)})});</script></body></html>"""
-DEBT_DETAIL_TEMPLATE = """<!DOCTYPE html><html lang="th"><head><meta charset="UTF-8"><title>รายละเอียดหนี้: {{debt.name}}</title><link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css"><link href="https://fonts.googleapis.com/css2?family=Sarabun:wght@400;500;700&display=swap" rel="stylesheet"><style>body{font-family:'Sarabun',sans-serif;background-color:#f8f9fa}</style></head><body><div class="container mt-4"><nav aria-label="breadcrumb"><ol class="breadcrumb"><li class="breadcrumb-item"><a href="{{url_for('main.index')}}">Dashboard</a></li><li class="breadcrumb-item active" aria-current="page">{{debt.name}}</li></ol></nav><div class="row g-4"><div class="col-md-4"><div class="card"><div class="card-body text-center"><h5 class="card-title">{{debt.name}}</h5><p class="display-4 text-danger fw-bold">฿{{"%.2f"|format(debt.current_balance)}}</p><p class="text-muted">ยอดคงเหลือ</p><div class="progress mb-3"><div class="progress-bar bg-success" style="width:{{(100-(debt.current_balance/debt.initial_balance*100)) if debt.initial_balance > 0 else 0}}%"></div></div><form class="d-flex gap-2" onsubmit="calculatePayoff(event,{{debt.id}})"><input type="number" step="0.01" class="form-control" placeholder="โปะเพิ่ม/เดือน"><button type="submit" class="btn btn-info flex-shrink-0"><i class="bi bi-calculator"></i> คำนวณ</button></form><small id="debt-result-{{debt.id}}" class="form-text text-muted d-block mt-1"></small></div><ul class="list-group list-group-flush"><li class="list-group-item d-flex justify-content-between"><span>ยอดตั้งต้น:</span><strong>{{"%.2f"|format(debt.initial_balance)}}</strong></li><li class="list-group-item d-flex justify-content-between"><span>ชำระไปแล้ว:</span><strong class="text-success">{{"%.2f"|format(total_paid)}}</strong></li><li class="list-group-item d-flex justify-content-between"><span>ขั้นต่ำ:</span><strong>{{"%.2f"|format(debt.min_payment)}}/เดือน</strong></li><li class="list-group-item d-flex justify-content-between"><span>ครบกำหนด:</span><strong>วันที่ {{debt.due_day}}</strong></li></ul></div></div><div class="col-md-8"><div class="card"><div class="card-header d-flex justify-content-between align-items-center"><span><i class="bi bi-clock-history me-1"></i> ประวัติการชำระเงิน</span><button class="btn btn-sm btn-primary" data-bs-toggle="modal" data-bs-target="#addTransactionModal"><i class="bi bi-plus-lg"></i> บันทึกการชำระ</button></div><div class="card-body">{% if payment_history %}<table class="table"><thead><tr><th>วันที่</th><th>รายละเอียด</th><th class="text-end">จำนวนเงิน</th></tr></thead><tbody>{% for tx in payment_history %}<tr><td>{{tx.date.strftime('%Y-%m-%d')}}</td><td>{{tx.description}}</td><td class="text-end text-danger">-{{"%.2f"|format(tx.amount)}}</td></tr>{% endfor %}</tbody></table>{% else %}<p class="text-center text-muted p-4">ยังไม่มีประวัติการชำระสำหรับหนี้ก้อนนี้</p>{% endif %}</div></div></div></div></div><div class="modal fade" id="addTransactionModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_transaction')}}" method="POST"><div class="modal-header"><h5 class="modal-title">บันทึกการชำระหนี้: {{debt.name}}</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><input type="hidden" name="type" value="expense"><input type="hidden" name="category" value="ชำระหนี้"><input type="hidden" name="debt_paid" value="{{debt.name}}"><div class="mb-3"><label class="form-label">วันที่ชำระ</label><input type="date" name="date" class="form-control" value="{{today.strftime('%Y-%m-%d')}}" required></div><div class="mb-3"><label class="form-label">จำนวนเงินที่ชำระ</label><input type="number" step="0.01" name="amount" class="form-control" placeholder="0.00" required></div><div class="mb-3"><label class="form-label">รายละเอียด (ไม่บังคับ)</label><input type="text" name="description" class="form-control" value="ชำระหนี้ {{debt.name}}"></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div><script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script><script>async function calculatePayoff(e,t){e.preventDefault();const a=e.target,l=a.querySelector('input').value||0,o=document.getElementById(`debt-result-${t}`);o.textContent='กำลังคำนวณ...';const n=new FormData;n.append('debt_id',t),n.append('extra_payment',l);try{const e=await fetch("{{url_for('main.calculate_debt')}}",{method:'POST',body:n}),t=await e.json();t.error?o.textContent=`ข้อผิดพลาด: ${t.error}`:o.innerHTML=`<strong>ผล:</strong> หมดใน <strong>${t.duration}</strong> (~${t.payoff_date})`}catch(e){o.textContent='เกิดข้อผิดพลาดในการเชื่อมต่อ'}}</script></body></html>"""
+HTML_TEMPLATE = """<!DOCTYPE html><html lang="th" data-bs-theme="light"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Finance Dashboard</title><link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css"><link href="https://fonts.googleapis.com/css2?family=Sarabun:wght@400;500;700&display=swap" rel="stylesheet"><style>body{font-family:'Sarabun',sans-serif;background-color:#f0f2f5}.card{border:none;border-radius:.8rem;box-shadow:0 4px 12px rgba(0,0,0,.08);overflow:hidden}.debt-card{transition:transform .2s ease-in-out}.debt-card:hover{transform:translateY(-5px);box-shadow:0 8px 20px rgba(0,0,0,.12)}.table-responsive{max-height:65vh}.net-positive{color:#198754!important}.net-negative{color:#dc3545!important}.sticky-top{top:1rem}a{text-decoration:none}</style></head><body><div class="container-fluid p-4"><header class="d-flex justify-content-between align-items-center mb-4"><h1 class="h3 mb-0"><i class="bi bi-wallet2 me-2"></i>Finance Dashboard <small class="text-muted h6">({{ current_user.username }})</small></h1><div><button class="btn btn-primary" data-bs-toggle="modal" data-bs-target="#addTransactionModal"><i class="bi bi-plus-circle me-1"></i> เพิ่มรายการ</button><button class="btn btn-warning text-dark" data-bs-toggle="modal" data-bs-target="#addDebtModal"><i class="bi bi-credit-card me-1"></i> เพิ่มหนี้สิน</button><a href="{{ url_for('auth.logout') }}" class="btn btn-outline-secondary"><i class="bi bi-box-arrow-right me-1"></i> ออกจากระบบ</a></div></header>{% with messages = get_flashed_messages(with_categories=true) %}{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }} alert-dismissible fade show" role="alert">{{ message }}<button type="button" class="btn-close" data-bs-dismiss="alert"></button></div>{% endfor %}{% endif %}{% endwith %}<div class="row g-4"><div class="col-lg-4"><div class="sticky-top"><div class="card mb-4"><div class="card-body"><h5 class="card-title mb-3"><i class="bi bi-bar-chart-line me-2"></i>สรุปภาพรวม</h5><form method="GET" action="{{url_for('main.index')}}" class="d-flex gap-2 mb-3"><select name="month" class="form-select form-select-sm">{% for i in range(1,13) %}<option value="{{i}}" {% if i==current_month %}selected{% endif %}>เดือน {{i}}</option>{% endfor %}</select><select name="year" class="form-select form-select-sm">{{ fragments.year_options }}</select><button type="submit" class="btn btn-sm btn-outline-primary"><i class="bi bi-search"></i></button></form><div class="d-flex justify-content-around text-center"><div><small class="text-muted">รายรับ</small><p class="h5 net-positive mb-0">{{ "%.2f"|format(summary.total_income) }}</p></div><div><small class="text-muted">รายจ่าย</small><p class="h5 net-negative mb-0">{{ "%.2f"|format(summary.total_expense) }}</p></div><div><small class="text-muted">คงเหลือ</small><p class="h5 {{'net-positive' if summary.net_balance >=0 else 'net-negative'}} mb-0">{{ "%.2f"|format(summary.net_balance) }}</p></div></div></div></div><div class="card"><div class="card-body"><h5 class="card-title mb-3"><i class="bi bi-pie-chart me-2"></i>สัดส่วนรายจ่าย</h5><div style="height:300px"><canvas id="expenseChart"></canvas></div></div></div></div></div><div class="col-lg-8"><h4 class="mb-3"><i class="bi bi-journal-text me-2"></i>ติดตามหนี้สิน</h4><div class="row g-4">{{ fragments.debt_cards }}</div><div class="card mt-4"><div class="card-header bg-white d-flex justify-content-between align-items-center"><h5 class="mb-0"><i class="bi bi-list-ul me-2"></i>ประวัติรายการล่าสุด</h5><div><a class="btn btn-sm btn-outline-secondary" href="{{url_for('main.export_transactions')}}"><i class="bi bi-download me-1"></i>ส่งออก</a> <button class="btn btn-sm btn-outline-secondary" data-bs-toggle="modal" data-bs-target="#importModal"><i class="bi bi-upload me-1"></i>นำเข้า</button> <button class="btn btn-sm btn-outline-secondary" data-bs-toggle="modal" data-bs-target="#addCategoryModal"><i class="bi bi-tag-fill me-1"></i>จัดการหมวดหมู่</button></div></div><div class="table-responsive"><table class="table table-hover mb-0 align-middle"><tbody>{% for tx in data.transactions %}<tr><td class="ps-3"><i class="bi h5 mb-0 {{'bi-arrow-down-circle-fill text-success' if tx.type=='income' else 'bi-arrow-up-circle-fill text-danger'}}"></i></td><td>{{tx.date.strftime('%Y-%m-%d')}}</td><td><strong>{{tx.description}}</strong><br><small class="text-muted">{{tx.category}}</small></td><td class="text-end fw-bold {{'net-positive' if tx.type=='income' else 'net-negative'}}">{{('+' if tx.type=='income' else '-')~"%.2f"|format(tx.amount)}}</td><td class="text-end pe-3"><form action="{{url_for('main.delete_transaction',tx_id=tx.id)}}" method="POST" onsubmit="return confirm('แน่ใจหรือไม่?')"><button type="submit" class="btn btn-sm border-0"><i class="bi bi-x-lg text-muted"></i></button></form></td></tr>{% endfor %}</tbody></table></div></div></div></div></div><div class="modal fade" id="addTransactionModal" tabindex="-1"><div class="modal-dialog modal-lg"><div class="modal-content"><form action="{{url_for('main.add_transaction')}}" method="POST"><div class="modal-header"><h5 class="modal-title">เพิ่มรายการ</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="row"><div class="col-md-6"><div class="mb-3"><input type="date" name="date" class="form-control" value="{{today.strftime('%Y-%m-%d')}}" required></div><div class="mb-3"><input type="text" name="description" class="form-control" placeholder="รายการ" required></div><div class="mb-3"><select name="type" class="form-select" id="transactionType"><option value="expense">รายจ่าย</option><option value="income">รายรับ</option></select></div><div class="mb-3"><label class="form-label">หมวดหมู่</label><select name="category" id="category-select" class="form-select" required></select></div><div class="mb-3" id="debt-payment-field" style="display:none"><label class="form-label">ชำระหนี้สำหรับ</label><select name="debt_id" class="form-select"><option value="">-- ไม่ระบุ --</option>{{ fragments.debt_options }}</select></div><div class="mb-3"><label class="form-label">จำนวนเงินรวม</label><input type="number" step="0.01" name="amount" id="totalAmount" class="form-control" placeholder="0.00" required></div></div><div class="col-md-6 border-start"><h6><i class="bi bi-receipt"></i> เครื่องคิดเลขรายการย่อย</h6><div id="item-list"></div><button type="button" class="btn btn-sm btn-outline-secondary" id="addItemBtn"><i class="bi bi-plus-lg"></i> เพิ่มรายการย่อย</button></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div><div class="modal fade" id="addCategoryModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_category')}}" method="POST"><div class="modal-header"><h5 class="modal-title">จัดการหมวดหมู่</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><label class="form-label">ประเภท</label><select name="type" class="form-select"><option value="expense">รายจ่าย</option><option value="income">รายรับ</option></select></div><div class="mb-3"><label class="form-label">ชื่อหมวดหมู่ใหม่</label><input type="text" name="name" class="form-control" required></div><button type="submit" class="btn btn-primary w-100">เพิ่มหมวดหมู่</button><hr><p>หมวดหมู่ที่มีอยู่:</p><ul class="list-group">{{ fragments.category_list }}</ul></div></form></div></div></div><div class="modal fade" id="importModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.import_transactions_view')}}" method="POST" enctype="multipart/form-data"><div class="modal-header"><h5 class="modal-title">นำเข้ารายการจากไฟล์ (CSV/OFX)</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><input type="file" name="file" class="form-control" accept=".csv,.ofx,.qfx" required></div><small class="text-muted">CSV: date,description,type,category,amount,debt_paid</small></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-primary">นำเข้า</button></div></form></div></div></div><div class="modal fade" id="addDebtModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_debt')}}" method="POST"><div class="modal-header"><h5 class="modal-title">เพิ่มหนี้สิน</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><input type="text" name="name" class="form-control" placeholder="ชื่อหนี้" required></div><div class="mb-3"><input type="number" step="0.01" name="balance" class="form-control" placeholder="ยอดหนี้ทั้งหมด" required></div><div class="row g-2 mb-3"><div class="col-8"><input type="number" step="0.01" name="rate_percent" class="form-control" placeholder="อัตราดอกเบี้ย" required></div><div class="col-4"><select name="rate_type" class="form-select"><option value="yearly">ต่อปี</option><option value="monthly">ต่อเดือน</option></select></div></div><div class="row g-2 mb-3"><div class="col-8"><input type="number" step="0.01" name="min_payment" class="form-control" placeholder="ชำระขั้นต่ำ/เดือน" required></div><div class="col-4"><div class="input-group"><input type="number" name="due_day" class="form-control" placeholder="วันที่" value="1" min="1" max="31" required></div></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-warning text-dark">เพิ่มหนี้</button></div></form></div></div></div>{{ fragments.debt_modals }}<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script><script src="https://cdn.jsdelivr.net/npm/chart.js"></script><script>document.addEventListener('DOMContentLoaded',function(){const e={{summary.expense_by_category_json|safe}},t=document.getElementById("expenseChart");t&&e&&e.labels&&e.labels.length>0?new Chart(t,{type:"doughnut",data:{labels:e.labels,datasets:[{data:e.data,backgroundColor:["#ff6384","#36a2eb","#ffce56","#4bc0c0","#9966ff","#ff9f40","#c9cbcf"],borderColor:"#fff",borderWidth:2,hoverOffset:8}]},options:{responsive:!0,maintainAspectRatio:!1,animation:{animateScale:!0,animateRotate:!0},plugins:{legend:{position:"bottom",labels:{usePointStyle:!0,padding:20,font:{family:"Sarabun"}}},tooltip:{yAlign:"bottom",displayColors:!1,bodyFont:{family:"Sarabun"},titleFont:{family:"Sarabun"},callbacks:{label:function(e){let t=e.label||"",a=e.raw,l=e.chart.getDatasetMeta(0).total,o=(a/l*100).toFixed(2)+"%";return`${t} ${new Intl.NumberFormat("th-TH",{style:"currency",currency:"THB"}).format(a)} (${o})`}}}}}}):t&&(t.getContext("2d").textAlign="center",t.getContext("2d").textBaseline="middle",t.getContext("2d").font="16px 'Sarabun'",t.getContext("2d").fillStyle="#6c757d",t.getContext("2d").fillText("ไม่มีข้อมูลรายจ่ายในเดือนนี้",t.canvas.width/2,50));const a={{data.categories|tojson|safe}},l=document.getElementById("category-select"),o=document.getElementById("transactionType"),n=document.getElementById("debt-payment-field"),d=()=>{n&&(n.style.display="expense"===o.value&&"ชำระหนี้"===l.value?"block":"none")},c=e=>{if(!l||!a)return;l.innerHTML="";const t=a[e]||[];t.forEach(e=>{const t=document.createElement("option");t.value=e,t.textContent=e,l.appendChild(t)}),d()};o&&o.addEventListener("change",()=>c(o.value)),l&&l.addEventListener("change",d),o&&c(o.value);const i=document.getElementById("item-list"),s=document.getElementById("totalAmount"),r=document.getElementById("addItemBtn");function m(){if(!s)return;let e=0;document.querySelectorAll(".item-price").forEach(t=>{e+=parseFloat(t.value)||0}),s.value=e.toFixed(2)}r&&r.addEventListener("click",()=>{if(!i)return;const e=document.createElement("div");e.className="d-flex gap-2 mb-2 item-row",e.innerHTML=`<input type="text" class="form-control form-control-sm" placeholder="ชื่อของ"><input type="number" step="0.01" class="form-control form-control-sm item-price" placeholder="ราคา"><button type="button" class="btn btn-sm btn-outline-danger" onclick="this.closest('.item-row').remove();m();">X</button>`,i.appendChild(e),e.querySelector(".item-price").addEventListener("input",m)})});</script></body></html>"""
+DEBT_DETAIL_TEMPLATE = """<!DOCTYPE html><html lang="th"><head><meta charset="UTF-8"><title>รายละเอียดหนี้: {{debt.name}}</title><link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css"><link href="https://fonts.googleapis.com/css2?family=Sarabun:wght@400;500;700&display=swap" rel="stylesheet"><style>body{font-family:'Sarabun',sans-serif;background-color:#f8f9fa}</style></head><body><div class="container mt-4"><nav aria-label="breadcrumb"><ol class="breadcrumb"><li class="breadcrumb-item"><a href="{{url_for('main.index')}}">Dashboard</a></li><li class="breadcrumb-item active" aria-current="page">{{debt.name}}</li></ol></nav><div class="row g-4"><div class="col-md-4"><div class="card"><div class="card-body text-center"><h5 class="card-title">{{debt.name}}</h5><p class="display-4 text-danger fw-bold">฿{{"%.2f"|format(debt.current_balance)}}</p><p class="text-muted">ยอดคงเหลือ</p><div class="progress mb-3"><div class="progress-bar bg-success" style="width:{{(100-(debt.current_balance/debt.initial_balance*100)) if debt.initial_balance > 0 else 0}}%"></div></div><form class="d-flex gap-2" onsubmit="calculatePayoff(event,{{debt.id}})"><input type="number" step="0.01" class="form-control" placeholder="โปะเพิ่ม/เดือน"><button type="submit" class="btn btn-info flex-shrink-0"><i class="bi bi-calculator"></i> คำนวณ</button></form><small id="debt-result-{{debt.id}}" class="form-text text-muted d-block mt-1"></small></div><ul class="list-group list-group-flush"><li class="list-group-item d-flex justify-content-between"><span>ยอดตั้งต้น:</span><strong>{{"%.2f"|format(debt.initial_balance)}}</strong></li><li class="list-group-item d-flex justify-content-between"><span>ชำระไปแล้ว:</span><strong class="text-success">{{"%.2f"|format(total_paid)}}</strong></li><li class="list-group-item d-flex justify-content-between"><span>ขั้นต่ำ:</span><strong>{{"%.2f"|format(debt.min_payment)}}/เดือน</strong></li><li class="list-group-item d-flex justify-content-between"><span>ครบกำหนด:</span><strong>วันที่ {{debt.due_day}}</strong></li></ul></div></div><div class="col-md-8"><div class="card"><div class="card-header d-flex justify-content-between align-items-center"><span><i class="bi bi-clock-history me-1"></i> ประวัติการชำระเงิน <a class="ms-2 small" href="{{url_for('main.export_transactions',debt_id=debt.id)}}"><i class="bi bi-download"></i> CSV</a></span><button class="btn btn-sm btn-primary" data-bs-toggle="modal" data-bs-target="#addTransactionModal"><i class="bi bi-plus-lg"></i> บันทึกการชำระ</button></div><div class="card-body">{% if payment_history %}<table class="table"><thead><tr><th>วันที่</th><th>รายละเอียด</th><th class="text-end">จำนวนเงิน</th></tr></thead><tbody>{% for tx in payment_history %}<tr><td>{{tx.date.strftime('%Y-%m-%d')}}</td><td>{{tx.description}}</td><td class="text-end text-danger">-{{"%.2f"|format(tx.amount)}}</td></tr>{% endfor %}</tbody></table>{% if pagination.pages > 1 %}<nav class="d-flex justify-content-between align-items-center"><a class="btn btn-sm btn-outline-secondary {{'disabled' if not pagination.has_prev}}" href="{{url_for('main.debt_detail',debt_id=debt.id,page=pagination.prev_num)}}">&laquo;</a><small class="text-muted">หน้า {{pagination.page}} / {{pagination.pages}}</small><a class="btn btn-sm btn-outline-secondary {{'disabled' if not pagination.has_next}}" href="{{url_for('main.debt_detail',debt_id=debt.id,page=pagination.next_num)}}">&raquo;</a></nav>{% endif %}{% else %}<p class="text-center text-muted p-4">ยังไม่มีประวัติการชำระสำหรับหนี้ก้อนนี้</p>{% endif %}</div></div></div></div></div><div class="modal fade" id="addTransactionModal" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.add_transaction')}}" method="POST"><div class="modal-header"><h5 class="modal-title">บันทึกการชำระหนี้: {{debt.name}}</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><input type="hidden" name="type" value="expense"><input type="hidden" name="category" value="ชำระหนี้"><input type="hidden" name="debt_id" value="{{debt.id}}"><div class="mb-3"><label class="form-label">วันที่ชำระ</label><input type="date" name="date" class="form-control" value="{{today.strftime('%Y-%m-%d')}}" required></div><div class="mb-3"><label class="form-label">จำนวนเงินที่ชำระ</label><input type="number" step="0.01" name="amount" class="form-control" placeholder="0.00" required></div><div class="mb-3"><label class="form-label">รายละเอียด (ไม่บังคับ)</label><input type="text" name="description" class="form-control" value="ชำระหนี้ {{debt.name}}"></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ปิด</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div><script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script><script>async function calculatePayoff(e,t){e.preventDefault();const a=e.target,l=a.querySelector('input').value||0,o=document.getElementById(`debt-result-${t}`);o.textContent='กำลังคำนวณ...';const n=new FormData;n.append('debt_id',t),n.append('extra_payment',l);try{const e=await fetch("{{url_for('main.calculate_debt')}}",{method:'POST',body:n}),t=await e.json();t.error?o.textContent=`ข้อผิดพลาด: ${t.error}`:o.innerHTML=`<strong>ผล:</strong> หมดใน <strong>${t.duration}</strong> (~${t.payoff_date})`}catch(e){o.textContent='เกิดข้อผิดพลาดในการเชื่อมต่อ'}}</script></body></html>"""
+YEAR_OPTIONS_FRAGMENT = """{% for y in all_years %}<option value="{{y}}" {% if y==current_year %}selected{% endif %}>{{y}}</option>{% endfor %}"""
+DEBT_CARDS_FRAGMENT = """{% if data.debts %}{% for debt in data.debts %}<div class="col-md-6"><div class="card debt-card h-100"><div class="card-body position-relative"><div class="d-flex justify-content-between align-items-start mb-2"><a href="{{url_for('main.debt_detail',debt_id=debt.id)}}" class="text-dark stretched-link"><h5 class="card-title mb-1">{{debt.name}}</h5></a><button class="btn btn-sm btn-outline-secondary border-0" data-bs-toggle="modal" data-bs-target="#editDebtModal-{{debt.id}}" style="z-index:5" onclick="event.stopPropagation();"><i class="bi bi-pencil-square"></i></button></div><p class="h3 mb-1">฿{{ "%.2f"|format(debt.current_balance) }}</p><small class="text-muted">จาก {{ "%.2f"|format(debt.initial_balance) }}</small><div class="progress mt-2 mb-3" role="progressbar" style="height:5px"><div class="progress-bar bg-success" style="width:{{(100-(debt.current_balance/debt.initial_balance*100)) if debt.initial_balance>0 else 0}}%"></div></div><p class="small text-muted mb-0"><i class="bi bi-calendar-check me-1"></i>ครบกำหนดวันที่ {{debt.due_day}}{% set days_left=debt.due_day-today.day %}{% if 0<=days_left<=5 %}<span class="badge bg-danger-subtle text-danger-emphasis rounded-pill ms-2">อีก {{days_left}} วัน</span>{% endif %}</p></div></div></div>{% endfor %}{% else %}<p class="text-center text-muted">ยังไม่มีข้อมูลหนี้สิน</p>{% endif %}"""
+DEBT_OPTIONS_FRAGMENT = """{% for debt in data.debts %}<option value="{{debt.id}}">{{debt.name}}</option>{% endfor %}"""
+CATEGORY_LIST_FRAGMENT = """{% for cat in data.categories.expense %}<li class="list-group-item">{{cat}} (รายจ่าย)</li>{% endfor %}{% for cat in data.categories.income %}<li class="list-group-item">{{cat}} (รายรับ)</li>{% endfor %}"""
+DEBT_MODALS_FRAGMENT = """{% for debt in data.debts %}<div class="modal fade" id="editDebtModal-{{debt.id}}" tabindex="-1"><div class="modal-dialog"><div class="modal-content"><form action="{{url_for('main.edit_debt',debt_id=debt.id)}}" method="POST"><div class="modal-header"><h5 class="modal-title">แก้ไขหนี้: {{debt.name}}</h5><button type="button" class="btn-close" data-bs-dismiss="modal"></button></div><div class="modal-body"><div class="mb-3"><label class="form-label">ชื่อหนี้</label><input type="text" name="name" class="form-control" value="{{debt.name}}" required></div><div class="row g-2 mb-3"><div class="col"><label class="form-label">ยอดตั้งต้น</label><input type="number" step="0.01" name="initial_balance" value="{{debt.initial_balance}}" class="form-control" required></div><div class="col"><label class="form-label">ยอดปัจจุบัน</label><input type="number" step="0.01" name="current_balance" value="{{debt.current_balance}}" class="form-control" required></div></div><div class="row g-2 mb-3"><div class="col-8"><label class="form-label">ดอกเบี้ย</label><input type="number" step="0.01" name="rate_percent" value="{{debt.rate_percent}}" class="form-control" required></div><div class="col-4"><label class="form-label"> </label><select name="rate_type" class="form-select"><option value="yearly" {% if debt.rate_type=='yearly'%}selected{% endif %}>ต่อปี</option><option value="monthly" {% if debt.rate_type=='monthly'%}selected{% endif %}>ต่อเดือน</option></select></div></div><div class="row g-2 mb-3"><div class="col-8"><label class="form-label">ขั้นต่ำ/เดือน</label><input type="number" step="0.01" name="min_payment" value="{{debt.min_payment}}" class="form-control" required></div><div class="col-4"><label class="form-label">วันครบกำหนด</label><input type="number" name="due_day" class="form-control" value="{{debt.due_day}}" min="1" max="31" required></div></div></div><div class="modal-footer"><button type="button" class="btn btn-secondary" data-bs-dismiss="modal">ยกเลิก</button><button type="submit" class="btn btn-primary">บันทึก</button></div></form></div></div></div>{% endfor %}"""
+
+# Compiled once per app by create_app() (see init_templates); fragments are cached per user-data version
+TEMPLATES = {
+    'auth.html': AUTH_TEMPLATE,
+    'dashboard.html': HTML_TEMPLATE,
+    'debt_detail.html': DEBT_DETAIL_TEMPLATE,
+    'fragments/year_options.html': YEAR_OPTIONS_FRAGMENT,
+    'fragments/debt_cards.html': DEBT_CARDS_FRAGMENT,
+    'fragments/debt_options.html': DEBT_OPTIONS_FRAGMENT,
+    'fragments/category_list.html': CATEGORY_LIST_FRAGMENT,
+    'fragments/debt_modals.html': DEBT_MODALS_FRAGMENT,
+}
+
+# --- CREATE APP INSTANCE FOR GUNICORN & LOCAL RUN ---
+app = create_app()
 
 # --- APP RUNNER ---
 if __name__ == '__main__':
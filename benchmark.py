@@ -0,0 +1,196 @@
+"""Seeded load benchmark for the hot routes.
+
+Seeds a database with synthetic users/debts/transactions, then reports
+p50/p99 latency of index, debt_detail, add_transaction and
+delete_transaction through the Flask test client. The render suite times
+dashboard rendering the old way (render_template_string, compiled per
+call) against the template registry with cached fragments. The startup
+suite boots fresh interpreters with and without FAST_STARTUP and reports
+app import time and the latency of the first dashboard request.
+
+    python benchmark.py --users 1000 --transactions 100000
+    python benchmark.py --database-url postgresql://localhost/finance_bench
+    python benchmark.py --suite render --skip-seed
+    python benchmark.py --suite startup --skip-seed --startup-runs 20
+
+The target database is wiped and reseeded unless --skip-seed is given.
+"""
+import argparse
+import datetime
+import os
+import json
+import random
+import subprocess
+import sys
+import time
+
+ROUTES = ('index', 'debt_detail', 'add_transaction', 'delete_transaction')
+STARTUP_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app as finance
+imported = time.perf_counter()
+client = finance.app.test_client()
+with client.session_transaction() as sess:
+    sess['_user_id'] = sys.argv[1]
+    sess['_fresh'] = True
+request_start = time.perf_counter()
+status = client.get('/').status_code
+print(json.dumps({'import': imported - start, 'first_request': time.perf_counter() - request_start, 'status': status}))
+'''
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench.sqlite3')}")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=100_000, help='total rows across all users')
+    parser.add_argument('--debts-per-user', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=200, help='requests per route')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data already in the database')
+    parser.add_argument('--suite', choices=('routes', 'render', 'startup', 'all'), default='routes')
+    parser.add_argument('--startup-runs', type=int, default=10, help='fresh interpreters per startup mode')
+    return parser.parse_args(argv)
+
+
+def seed(finance, users, transactions, debts_per_user, rng, chunk_size=10_000):
+    db = finance.db
+    db.drop_all()
+    finance.migrate_schema()
+    password_hash = finance.generate_password_hash('benchmark', method='pbkdf2:sha256')
+    db.session.execute(db.insert(finance.User), [{'username': f'bench{i}', 'password_hash': password_hash} for i in range(users)])
+    user_ids = [row[0] for row in db.session.execute(db.select(finance.User.id).order_by(finance.User.id))]
+    categories = {'expense': ['อาหารและเครื่องดื่ม', 'เดินทาง', 'ที่อยู่อาศัย', finance.DEBT_PAYMENT_CATEGORY, 'บันเทิง'], 'income': ['เงินเดือน', 'รายได้เสริม']}
+    db.session.execute(db.insert(finance.Category), [{'user_id': uid, 'name': name, 'type': kind} for uid in user_ids for kind, names in categories.items() for name in names])
+    db.session.execute(db.insert(finance.Debt), [
+        {'user_id': uid, 'name': f'debt{j}', 'initial_balance': 100_000.0, 'current_balance': 100_000.0, 'rate_percent': rng.uniform(3, 25), 'rate_type': 'yearly', 'min_payment': 2_000.0, 'due_day': rng.randint(1, 28)}
+        for uid in user_ids for j in range(debts_per_user)])
+    debts = {}
+    for debt_id, uid, name in db.session.execute(db.select(finance.Debt.id, finance.Debt.user_id, finance.Debt.name)): debts.setdefault(uid, []).append((debt_id, name))
+    today = datetime.date.today()
+    for start in range(0, transactions, chunk_size):
+        rows = []
+        for _ in range(min(chunk_size, transactions - start)):
+            uid = rng.choice(user_ids)
+            tx_type = 'income' if rng.random() < 0.2 else 'expense'
+            category = rng.choice(categories[tx_type])
+            debt_id, debt_name = rng.choice(debts[uid]) if category == finance.DEBT_PAYMENT_CATEGORY else (None, None)
+            rows.append({'user_id': uid, 'date': today - datetime.timedelta(days=rng.randint(0, 3 * 365)), 'description': category, 'type': tx_type,
+                         'category': category, 'amount': round(rng.uniform(10, 5_000), 2), 'debt_paid': debt_name, 'debt_id': debt_id})
+        db.session.execute(db.insert(finance.Transaction), rows)
+    db.session.commit()
+    finance.rebuild_monthly_summaries()
+
+
+def login_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def timed(fn):
+    start = time.perf_counter()
+    response = fn()
+    elapsed = time.perf_counter() - start
+    if response.status_code >= 400: raise RuntimeError(f"{response.request.path} -> {response.status_code}")
+    return elapsed
+
+
+def measure(finance, samples, rng):
+    # requests must run outside any app context, or they would share one long-lived session
+    app, db = finance.app, finance.db
+    with app.app_context():
+        user_ids = [row[0] for row in db.session.execute(db.select(finance.User.id))]
+        debt_of = dict(db.session.execute(db.select(finance.Debt.user_id, db.func.min(finance.Debt.id)).group_by(finance.Debt.user_id)).all())
+    sampled = [rng.choice(user_ids) for _ in range(samples)]
+    clients = {uid: login_client(app, uid) for uid in set(sampled)}
+    today = datetime.date.today().isoformat()
+    timings = {route: [] for route in ROUTES}
+    for uid in sampled: timings['index'].append(timed(lambda: clients[uid].get('/')))
+    for uid in sampled: timings['debt_detail'].append(timed(lambda: clients[uid].get(f'/debt/{debt_of[uid]}')))
+    for uid in sampled:
+        form = {'date': today, 'description': 'bench-add', 'type': 'expense', 'category': finance.DEBT_PAYMENT_CATEGORY, 'amount': '10', 'debt_id': str(debt_of[uid])}
+        timings['add_transaction'].append(timed(lambda: clients[uid].post('/add_transaction', data=form)))
+    with app.app_context():
+        added = db.session.execute(db.select(finance.Transaction.id, finance.Transaction.user_id).where(finance.Transaction.description == 'bench-add')).all()
+    for tx_id, uid in added:
+        client = clients.get(uid) or login_client(app, uid)
+        timings['delete_transaction'].append(timed(lambda: client.post(f'/delete_transaction/{tx_id}')))
+    return timings
+
+
+def measure_render(finance, samples, rng):
+    from flask import g, render_template_string
+    from flask_login import login_user
+    from markupsafe import Markup
+    app, db = finance.app, finance.db
+    timings = {'render_before': [], 'render_after': []}
+    with app.test_request_context('/'):
+        user = db.session.get(finance.User, db.session.execute(db.select(finance.Debt.user_id).limit(1)).scalar())
+        login_user(user)
+        today = datetime.date.today()
+        context = {
+            'data': {'transactions': finance.Transaction.query.filter_by(user_id=user.id).order_by(finance.Transaction.date.desc()).limit(15).all(), **finance.cached_reference_data(user.id)},
+            'summary': {'total_income': 0.0, 'total_expense': 0.0, 'net_balance': 0.0, 'expense_by_category_json': '{"labels": [], "data": []}'},
+            'current_year': today.year, 'current_month': today.month, 'all_years': list(range(today.year - 5, today.year + 2)), 'today': today,
+        }
+        for _ in range(samples):
+            start = time.perf_counter()
+            fragments = {name: Markup(render_template_string(finance.TEMPLATES[f'fragments/{name}.html'], **context)) for name in finance.DASHBOARD_FRAGMENTS}
+            render_template_string(finance.HTML_TEMPLATE, fragments=fragments, **context)
+            timings['render_before'].append(time.perf_counter() - start)
+        for _ in range(samples):
+            g.pop('data_versions', None)
+            start = time.perf_counter()
+            finance.render_dashboard(user.id, **context)
+            timings['render_after'].append(time.perf_counter() - start)
+    return timings
+
+
+def measure_startup(finance, runs, database_url):
+    with finance.app.app_context():
+        user_id = finance.db.session.execute(finance.db.select(finance.User.id).limit(1)).scalar()
+    timings = {}
+    for mode, flag in (('default', '0'), ('fast', '1')):
+        env = {**os.environ, 'DATABASE_URL': database_url, 'FAST_STARTUP': flag}
+        for _ in range(runs):
+            start = time.perf_counter()
+            probe = subprocess.run([sys.executable, '-c', STARTUP_PROBE, str(user_id)], env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+            result = json.loads(probe.stdout.strip().splitlines()[-1])
+            if result['status'] >= 400: raise RuntimeError(f"first request -> {result['status']}")
+            timings.setdefault(f'boot_total[{mode}]', []).append(time.perf_counter() - start)
+            timings.setdefault(f'import[{mode}]', []).append(result['import'])
+            timings.setdefault(f'first_request[{mode}]', []).append(result['first_request'])
+    return timings
+
+
+def report(timings, out=sys.stdout):
+    import numpy as np
+    print(f"{'route':<24}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}", file=out)
+    for route, values in timings.items():
+        ms = np.array(values) * 1000
+        print(f"{route:<24}{len(ms):>6}{np.percentile(ms, 50):>10.2f}{np.percentile(ms, 99):>10.2f}{ms.mean():>10.2f}", file=out)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as finance
+    rng = random.Random(args.seed)
+    if not args.skip_seed:
+        start = time.perf_counter()
+        with finance.app.app_context(): seed(finance, args.users, args.transactions, args.debts_per_user, rng)
+        print(f"seeded {args.users} users / {args.transactions} transactions in {time.perf_counter() - start:.1f}s")
+    timings = {}
+    if args.suite in ('routes', 'all'): timings.update(measure(finance, args.samples, rng))
+    if args.suite in ('render', 'all'): timings.update(measure_render(finance, args.samples, rng))
+    if args.suite in ('startup', 'all'): timings.update(measure_startup(finance, args.startup_runs, args.database_url))
+    report(timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+    gunicorn app:app
+
+Gives each gunicorn master a fresh metrics directory shared by its workers
+(see MetricsRegistry in app.py), and removes it when the master exits.
+"""
+import os
+import shutil
+import tempfile
+
+# Evaluated in the master before any worker forks, so every worker inherits the same directory
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'finance-tracker-metrics-{os.getpid()}'))
+
+
+def on_starting(server):
+    # files left by an earlier deployment would otherwise be summed into this one's counters
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='finance-tracker-test-'), 'test.sqlite3')
+os.environ['DATABASE_URL'] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as finance  # noqa: E402
+
+
+@pytest.fixture
+def user_id():
+    with finance.app.app_context():
+        finance.db.drop_all()
+        finance.db.create_all()
+        user = finance.User(username='importer', password_hash='x')
+        finance.db.session.add(user)
+        finance.db.session.commit()
+        yield user.id
+
+
+def import_text(user_id, text, fmt='csv'):
+    return finance.import_transactions(user_id, io.StringIO(text), fmt)
+
+
+def test_csv_row_with_extra_fields_is_imported(user_id):
+    imported, errors = import_text(user_id, "date,description,amount\n2025-01-10,coffee,-42.5,unexpected\n2025-01-11,refund,100\n")
+    assert (imported, errors) == (2, [])
+
+
+def test_non_finite_amounts_are_skipped(user_id):
+    imported, errors = import_text(user_id, "date,description,amount\n2025-01-10,a,1e309\n2025-01-10,b,nan\n2025-01-10,c,-inf\n2025-01-11,ok,-10\n")
+    assert imported == 1
+    assert [e.split(':')[0] for e in errors] == ['line 2', 'line 3', 'line 4']
+    assert finance.MonthlySummary.query.one().total == 10.0
+
+
+def test_single_line_ofx_imports_every_record(user_id):
+    ofx = ('<OFX><BANKTRANLIST><STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250110<TRNAMT>-1.5<NAME>A</STMTTRN>'
+           '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250111<TRNAMT>-2<NAME>B</STMTTRN></BANKTRANLIST></OFX>')
+    assert import_text(user_id, ofx, fmt='ofx') == (2, [])
+    assert sorted(t.description for t in finance.Transaction.query) == ['A', 'B']